@@ -3,18 +3,31 @@ from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from collections import defaultdict
-import analysis
-import plots
 import config as c
-import generateplots
-from dataclass import Data
-import yaml
+import export
+import timings
 
-from matplotlib.backends.backend_qt5agg import (FigureCanvas, NavigationToolbar2QT as NavigationToolbar)
-from matplotlib.pyplot import close as closeFigure
 from numpy.random import randint
 from os.path import dirname, exists
-from os import makedirs
+from os import makedirs, stat
+from multiprocessing import freeze_support
+
+# analysis, plots, generateplots and matplotlib are imported when they are first used instead of at the top. They pull
+# in scipy and matplotlib, which made the window slow to appear while the user hadn't asked for either yet.
+
+# Closes matplotlib figures, importing pyplot on first use
+def closeFigure(figure):
+	from matplotlib.pyplot import close
+	close(figure)
+
+# Shows the timings of a run (see timings.py) in a message box, with the per-dataset timings as details
+def showTimings(parent, title, stages, details=None):
+	messageBox = QMessageBox(parent)
+	messageBox.setWindowTitle(title)
+	messageBox.setText(timings.FormatStages(stages))
+	if details:
+		messageBox.setDetailedText(details)
+	messageBox.exec_()
 
 # Commonly used LineEdit
 class LineEdit(QFormLayout):
@@ -55,9 +68,20 @@ class DataAnalysisWorker(QObject):
 		self.config = config
 
 	def run(self):
+		import analysis
 		analysis.DataAnalysis(self.config, self.progress)
 		self.finished.emit()
 
+# Progress reporter for work that runs in the GUI thread (plots have to be made there). Same emit() interface as the
+# progress signal of the analysis worker; processing events keeps the window responsive while plots are saved.
+class ProgressBarUpdater():
+	def __init__(self, progressBar):
+		self.progressBar = progressBar
+
+	def emit(self, i):
+		self.progressBar.setValue(i)
+		QApplication.processEvents()
+
 # Plot tab
 class Plot(QWidget):
 	def __init__(self,parent,*args,**kwargs):
@@ -102,7 +126,8 @@ class Plot(QWidget):
 
 
 		# CANVAS
-		self.canvas = FigureCanvas()
+		# Empty placeholder until the first preview, so matplotlib's Qt backend isn't loaded at start up
+		self.canvas = QWidget()
 		self.plotWindowLayout.addWidget(self.canvas)
 
 
@@ -130,10 +155,20 @@ class Plot(QWidget):
 		exportConfigLayout.insertRow(0,exportConfigLabel,self.exportConfigLine)
 		loadDataLayout.addLayout(exportConfigLayout)
 
+		# Export loaded by setConfigsAndGetData: ((path, modification time), export config, data list)
+		self.exportCache = None
+
 		self.useLatexCheckBox = QCheckBox()
 		self.useLatexCheckBox.setText("Use LaTeX to generate text")
 		loadDataLayout.addWidget(self.useLatexCheckBox)
 
+		self.plotWorkers = LineEdit("Workers:", "1")
+		loadDataLayout.addLayout(self.plotWorkers)
+
+		self.plotTimingsCheckBox = QCheckBox()
+		self.plotTimingsCheckBox.setText("Show timings after saving")
+		loadDataLayout.addWidget(self.plotTimingsCheckBox)
+
 
 		# HISTOGRAM
 		self.histogramFrame = QWidget()
@@ -435,65 +470,70 @@ class Plot(QWidget):
 
 
 		# GENERATE BUTTON
+		generateLayout = QHBoxLayout()
+		self.generateProgressBar = QProgressBar()
+		self.generateProgressBar.setValue(0)
+		generateLayout.addWidget(self.generateProgressBar)
+
 		self.generateButton = QPushButton()
 		self.generateButton.setText("Save")
 		self.generateButton.setMaximumWidth(100)
-		plotParamLayout.addWidget(self.generateButton)
+		generateLayout.addWidget(self.generateButton)
+		plotParamLayout.addLayout(generateLayout)
 		self.generateButton.clicked.connect(self.generatePlots)
 
 	def showHistogram(self):
+		import plots
 		closeFigure("all")
 		dataList = self.setConfigsAndGetData()
 		plots.setFont()
 
 		rand = randint(low = 0, high = len(dataList))
 		figure = plots.HistogramPlot(dataList[rand])
-		self.plotWindowLayout.removeWidget(self.canvas)
-		self.canvas.deleteLater()
-		self.canvas = FigureCanvas(figure)
-		self.plotWindowLayout.addWidget(self.canvas)
+		self.setCanvas(figure)
 
 	def showHistogram2D(self):
+		import plots
 		closeFigure("all")
 		dataList = self.setConfigsAndGetData()
 		plots.setFont()
 
 		Histogram2D = plots.Histogram2D(dataList)
 		figure = plots.Histogram2DPlot(Histogram2D)
-		self.plotWindowLayout.removeWidget(self.canvas)
-		self.canvas.deleteLater()
-		self.canvas = FigureCanvas(figure)
-		self.plotWindowLayout.addWidget(self.canvas)
+		self.setCanvas(figure)
 
 	def showViolinplot(self):
+		import plots
 		closeFigure("all")
 		dataList = self.setConfigsAndGetData()
 		plots.setFont()
 
 		figure = plots.ViolinPlot(dataList)
-		self.plotWindowLayout.removeWidget(self.canvas)
-		self.canvas.deleteLater()
-		self.canvas = FigureCanvas(figure)
-		self.plotWindowLayout.addWidget(self.canvas)
+		self.setCanvas(figure)
 
 	def showSimplePlot(self):
+		import plots
 		closeFigure("all")
 		dataList = self.setConfigsAndGetData()
 		plots.setFont()
 
 		figure = plots.SimplePlot(dataList)
-		self.plotWindowLayout.removeWidget(self.canvas)
-		self.canvas.deleteLater()
-		self.canvas = FigureCanvas(figure)
-		self.plotWindowLayout.addWidget(self.canvas)
+		self.setCanvas(figure)
 
 	def showECDF(self):
+		import plots
 		closeFigure("all")
 		dataList = self.setConfigsAndGetData()
 		plots.setFont()
 
 		rand = randint(low = 0, high = len(dataList))
 		figure = plots.ECDF(dataList[rand])
+		self.setCanvas(figure)
+
+	# Replaces the canvas in the plot window with one showing figure
+	def setCanvas(self, figure):
+		from matplotlib.backends.backend_qt5agg import FigureCanvas
+
 		self.plotWindowLayout.removeWidget(self.canvas)
 		self.canvas.deleteLater()
 		self.canvas = FigureCanvas(figure)
@@ -501,18 +541,29 @@ class Plot(QWidget):
 
 	def setConfigsAndGetData(self):
 		configPlot = self.constructConfigPlot()
-		with open(self.data_dir[0]) as file:
-			configExport = yaml.load(file, Loader = yaml.Loader)
+
+		# Keep the loaded export in memory while the same, unmodified file is selected. Changing plot options then doesn't
+		# re-read the data. Choosing another file or rewriting this one (new modification time) loads it again.
+		exportKey = (self.data_dir[0], stat(self.data_dir[0]).st_mtime_ns)
+		if self.exportCache == None or self.exportCache[0] != exportKey:
+			if self.exportCache != None:
+				export.CloseExport(self.exportCache[2])
+				self.exportCache = None
+			self.exportCache = (exportKey,) + export.LoadExport(self.data_dir[0])
+		_, configExport, dataList = self.exportCache
 
 		c.Config(configExport["Config"])
 		c.PlotConfig(configPlot)
 
-		dataList = []
-		for key in configExport["Data"]:
-			dataList.append(Data(**configExport["Data"][key]))
-
 		return dataList
 
+	# Previews, saving, choosing another export and the analysis tab
+	def setPlotActionsEnabled(self, enabled):
+		for widget in [self.showHistogramButton, self.showHistogram2dButton, self.showViolinplotButton,
+				self.showSimpleplotButton, self.showECDFButton, self.generateButton, self.exportConfigLine]:
+			widget.setEnabled(enabled)
+		self.parent.tabs.setTabEnabled(0, enabled)
+
 	def chooseExportConfig(self):
 		self.data_dir = QFileDialog.getOpenFileName(None, "Select Export Config")
 		try:
@@ -528,7 +579,18 @@ class Plot(QWidget):
 		if not exists(outputDir):
 			makedirs(outputDir)
 
-		generateplots.generateplots(dataList, outputDir)
+		self.generateProgressBar.setValue(0)
+		# The save processes events to update the progress bar, so anything that replaces the configs or starts other
+		# plots is disabled until it is done
+		self.setPlotActionsEnabled(False)
+		try:
+			import generateplots
+			stages = generateplots.generateplots(dataList, outputDir, ProgressBarUpdater(self.generateProgressBar))
+		finally:
+			self.setPlotActionsEnabled(True)
+
+		if stages:
+			showTimings(self, "Plot timings", stages)
 
 	def constructConfigPlot(self):
 		configPlot = defaultdict(dict)
@@ -538,6 +600,11 @@ class Plot(QWidget):
 			configPlot["General"]["LaTeX"] = True
 		else:
 			configPlot["General"]["LaTeX"] = False
+		configPlot["General"]["Workers"] = int(self.plotWorkers.LineEdit.text())
+		if self.plotTimingsCheckBox.checkState() == Qt.Checked:
+			configPlot["General"]["Timings"] = True
+		else:
+			configPlot["General"]["Timings"] = False
 
 
 		# HISTOGRAM
@@ -739,6 +806,23 @@ class DataAnalysis(QWidget):
 		fileParamLayout.addLayout(dataFolderLayout)
 
 
+		# Concentration file, for folders without the concentration in their name (optional)
+		concentrationFileLayout = QFormLayout()
+
+		# Label
+		concentrationFileLabel = QLabel("Concentration File:")
+
+		# Line edit
+		self.concentrationFileLine = QLineEdit()
+		self.concentrationFileLine.setMaximumWidth(500)
+		concentrationFileLineAction = self.concentrationFileLine.addAction(QIcon("folder.png"), QLineEdit.TrailingPosition)
+		concentrationFileLineAction.triggered.connect(self.chooseConcentrationFile)
+
+		# Add widgets to layouts
+		concentrationFileLayout.insertRow(0,concentrationFileLabel,self.concentrationFileLine)
+		fileParamLayout.addLayout(concentrationFileLayout)
+
+
 		# Blacklist folder
 		blacklistFolder_Layout = QVBoxLayout()
 		blacklistFolder_Top_Layout = QFormLayout()
@@ -814,6 +898,13 @@ class DataAnalysis(QWidget):
 		fileParamLayout.addLayout(blacklistConc_Layout)
 
 
+		# Cache parsed data files
+		self.cache_CheckBox = QCheckBox()
+		self.cache_CheckBox.setText("Cache parsed data files")
+		self.cache_CheckBox.setChecked(True)
+		fileParamLayout.addWidget(self.cache_CheckBox)
+
+
 
 		# DATAPARAM
 		dataParamLayout = QVBoxLayout()
@@ -894,6 +985,61 @@ class DataAnalysis(QWidget):
 		dataParamLayout.addLayout(dataBinningKDE_Layout)
 
 
+		# Worker processes
+		workers_Layout = QFormLayout()
+		workers_Button_Layout = QHBoxLayout()
+
+		# Label
+		workers_Label = QLabel("Workers:")
+
+		# Line edit
+		self.workers_LineEdit = QLineEdit()
+		self.workers_LineEdit.setMaximumWidth(50)
+		self.workers_LineEdit.setText("1")
+
+		# Add widgets to layouts
+		workers_Button_Layout.addWidget(self.workers_LineEdit)
+		workers_Layout.insertRow(0,workers_Label,workers_Button_Layout)
+		dataParamLayout.addLayout(workers_Layout)
+
+
+		# KDE bootstrap samples
+		kdeBootstrap_Layout = QFormLayout()
+		kdeBootstrap_Button_Layout = QHBoxLayout()
+
+		# Label
+		kdeBootstrap_Label = QLabel("KDE Bootstrap Samples:")
+
+		# Line edit
+		self.kdeBootstrap_LineEdit = QLineEdit()
+		self.kdeBootstrap_LineEdit.setMaximumWidth(50)
+		self.kdeBootstrap_LineEdit.setText("0")
+
+		# Add widgets to layouts
+		kdeBootstrap_Button_Layout.addWidget(self.kdeBootstrap_LineEdit)
+		kdeBootstrap_Layout.insertRow(0,kdeBootstrap_Label,kdeBootstrap_Button_Layout)
+		dataParamLayout.addLayout(kdeBootstrap_Layout)
+
+
+		# Cache the results of every dataset
+		self.resultCache_CheckBox = QCheckBox()
+		self.resultCache_CheckBox.setText("Reuse results of unchanged datasets")
+		self.resultCache_CheckBox.setChecked(True)
+		dataParamLayout.addWidget(self.resultCache_CheckBox)
+
+
+		# Timings
+		self.timings_CheckBox = QCheckBox()
+		self.timings_CheckBox.setText("Record timings")
+		dataParamLayout.addWidget(self.timings_CheckBox)
+
+		self.timingsMemory_CheckBox = QCheckBox()
+		self.timingsMemory_CheckBox.setText("Record peak memory (slower)")
+		self.timingsMemory_CheckBox.setEnabled(False)
+		self.timings_CheckBox.stateChanged.connect(lambda: self.timingsMemory_CheckBox.setEnabled(self.timings_CheckBox.checkState() == Qt.Checked))
+		dataParamLayout.addWidget(self.timingsMemory_CheckBox)
+
+
 
 		# FITTINGPARAM
 		fitParamLayout = QVBoxLayout()
@@ -945,6 +1091,22 @@ class DataAnalysis(QWidget):
 		p0c_Layout.insertRow(0,p0c_Label,self.p0c_LineEdit)
 		fitParamLayout.addLayout(p0c_Layout)
 
+		# Fit engine: curve_fit fits the datasets one by one, batch fits them all at once
+		fitEngine_Layout = QFormLayout()
+
+		# Label
+		fitEngine_Label = QLabel("Fit Engine:")
+
+		# Combo box
+		self.fitEngine_ComboBox = QComboBox()
+		self.fitEngine_ComboBox.setMaximumWidth(80)
+		self.fitEngine_ComboBox.addItems(["curve_fit", "batch"])
+		self.fitEngine_ComboBox.setCurrentIndex(0)
+
+		# Add widgets to layouts
+		fitEngine_Layout.insertRow(0,fitEngine_Label,self.fitEngine_ComboBox)
+		fitParamLayout.addLayout(fitEngine_Layout)
+
 
 
 		# MODE DETECTION
@@ -961,6 +1123,23 @@ class DataAnalysis(QWidget):
 		modeDetection_Layout.addWidget(self.modeDetectionBoolean_CheckBox)
 
 
+		# Method: peaks of the KDE, or binned mean shift on the RMS values
+		modeDetectionMethod_Layout = QFormLayout()
+
+		# Label
+		modeDetectionMethod_Label = QLabel("Method:")
+
+		# Combo box
+		self.modeDetectionMethod_ComboBox = QComboBox()
+		self.modeDetectionMethod_ComboBox.setMaximumWidth(100)
+		self.modeDetectionMethod_ComboBox.addItems(["kde", "meanshift"])
+		self.modeDetectionMethod_ComboBox.setCurrentIndex(0)
+
+		# Add widgets to layouts
+		modeDetectionMethod_Layout.insertRow(0,modeDetectionMethod_Label,self.modeDetectionMethod_ComboBox)
+		modeDetection_Layout.addLayout(modeDetectionMethod_Layout)
+
+
 		# Height
 		Height_Layout = QFormLayout()
 
@@ -1013,6 +1192,7 @@ class DataAnalysis(QWidget):
 
 		# Start with Mode Detection disabled
 		self.modeDetectionBoolean_CheckBox.setCheckState(Qt.Unchecked)
+		self.modeDetectionMethod_ComboBox.setEnabled(False)
 		self.Distance_LineEdit.setEnabled(False)
 		self.Height_LineEdit.setEnabled(False)
 		self.Prominence_LineEdit.setEnabled(False)
@@ -1040,6 +1220,11 @@ class DataAnalysis(QWidget):
 		except NameError:
 			None
 
+	def chooseConcentrationFile(self):
+		concentrationFile, _ = QFileDialog.getOpenFileName(None, "Select Concentration File", "", "YAML files (*.yaml *.yml);;All files (*)")
+		if concentrationFile:
+			self.concentrationFileLine.setText(concentrationFile)
+
 	def choose_blacklist_directory(self):
 		curr_blacklist_List = QFileDialog.getExistingDirectory(None, "Select Folder")
 		try:
@@ -1075,10 +1260,12 @@ class DataAnalysis(QWidget):
 
 	def modeDetectionBoolean_Enable(self):
 		if self.modeDetectionBoolean_CheckBox.checkState() == Qt.Unchecked:
+			self.modeDetectionMethod_ComboBox.setEnabled(False)
 			self.Distance_LineEdit.setEnabled(False)
 			self.Height_LineEdit.setEnabled(False)
 			self.Prominence_LineEdit.setEnabled(False)
 		else:
+			self.modeDetectionMethod_ComboBox.setEnabled(True)
 			self.Distance_LineEdit.setEnabled(True)
 			self.Height_LineEdit.setEnabled(True)
 			self.Prominence_LineEdit.setEnabled(True)
@@ -1099,6 +1286,13 @@ class DataAnalysis(QWidget):
 			blacklistConc_list.append(float(self.blacklistConc_List.item(k).text()))
 		export_dict["FileParam"]["BlacklistConc"] = blacklistConc_list
 
+		export_dict["FileParam"]["ConcentrationMap"] = self.concentrationFileLine.text() or None
+
+		if self.cache_CheckBox.checkState() == Qt.Checked:
+			export_dict["FileParam"]["Cache"] = True
+		else:
+			export_dict["FileParam"]["Cache"] = False
+
 
 		# DATAPARAM
 		export_dict["DataParam"]["MinRMS"] = float(self.minRMS_LineEdit.text())
@@ -1106,17 +1300,36 @@ class DataAnalysis(QWidget):
 
 		export_dict["DataParam"]["Bin"] = self.bin_ComboBox.currentText()
 		export_dict["DataParam"]["KDE"] = self.dataBinningKDE_ComboBox.currentText()
+		export_dict["DataParam"]["KDEBootstrap"] = int(self.kdeBootstrap_LineEdit.text())
+		export_dict["DataParam"]["Workers"] = int(self.workers_LineEdit.text())
+
+		if self.resultCache_CheckBox.checkState() == Qt.Checked:
+			export_dict["DataParam"]["Cache"] = True
+		else:
+			export_dict["DataParam"]["Cache"] = False
+
+		if self.timings_CheckBox.checkState() == Qt.Checked:
+			export_dict["DataParam"]["Timings"] = True
+		else:
+			export_dict["DataParam"]["Timings"] = False
+
+		if self.timingsMemory_CheckBox.checkState() == Qt.Checked:
+			export_dict["DataParam"]["TimingsMemory"] = True
+		else:
+			export_dict["DataParam"]["TimingsMemory"] = False
 
 		# FITTINGPARAM
 		export_dict["FittingParam"]["p0a"] = float(self.p0a_LineEdit.text())
 		export_dict["FittingParam"]["p0b"] = None # Needs to be implemented
 		export_dict["FittingParam"]["p0c"] = float(self.p0c_LineEdit.text())
+		export_dict["FittingParam"]["Engine"] = self.fitEngine_ComboBox.currentText()
 
 		if self.modeDetectionBoolean_CheckBox.checkState() == Qt.Checked:
 			export_dict["FittingParam"]["ModeDetection"] = True
 		else:
 			export_dict["FittingParam"]["ModeDetection"] = False
 
+		export_dict["FittingParam"]["ModeDetectionMethod"] = self.modeDetectionMethod_ComboBox.currentText()
 		export_dict["FittingParam"]["ModeDetectionHeight"] = float(self.Height_LineEdit.text())
 		export_dict["FittingParam"]["ModeDetectionProminence"] = float(self.Prominence_LineEdit.text())
 		export_dict["FittingParam"]["ModeDetectionDistance"] = float(self.Distance_LineEdit.text())
@@ -1147,6 +1360,27 @@ class DataAnalysis(QWidget):
 			lambda: self.startButton.setEnabled(True)
 		)
 		self.thread.finished.connect(lambda: self.parent.tabs.setTabEnabled(1, True))
+		self.thread.finished.connect(self.showAnalysisTimings)
+		self.thread.finished.connect(self.showUnresolved)
+
+	# The analysis worker runs in this process, so the Timings section it added to the export config is available here
+	def showAnalysisTimings(self):
+		if c.Config.get("DataParam.Timings") and "Timings" in c.ExportConfig.config:
+			timingsSection = c.ExportConfig.config["Timings"]
+			details = "\n\n".join(dataset + "\n" + timings.FormatStages(stages) for dataset, stages in timingsSection["Datasets"].items())
+			showTimings(self, "Analysis timings", dict(timingsSection["Stages"], **{"All datasets, " + name: stage for name, stage in timingsSection["DatasetTotals"].items()}), details)
+
+	# Folders that were skipped because their concentration was not found
+	def showUnresolved(self):
+		if "Unresolved" in c.ExportConfig.config:
+			unresolved = c.ExportConfig.config["Unresolved"]
+			messageBox = QMessageBox(self)
+			messageBox.setIcon(QMessageBox.Warning)
+			messageBox.setWindowTitle("Concentrations not found")
+			messageBox.setText("No concentration found for " + str(len(unresolved)) + " folders, they were skipped. " +
+				"Add them to a concentration file or put a concentration.txt file in them.")
+			messageBox.setDetailedText("\n".join(unresolved))
+			messageBox.exec_()
 
 	def reportProgress(self, i):
 		self.progressBar.setValue(i)
@@ -1181,4 +1415,6 @@ def main():
 	sys.exit(app.exec_())
 
 if __name__ == '__main__':
+	# Needed for the analysis worker processes in the frozen Windows build
+	freeze_support()
 	main()
\ No newline at end of file
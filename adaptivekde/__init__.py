@@ -1,9 +1,11 @@
 from .sshist import sshist
 from .sskernel import sskernel
 from .ssvkernel import ssvkernel
+from .binnedkernel import binnedkernel
 
 __version__ = '1.0.0'
 
 __all__ = ('sshist',
            'sskernel',
-           'ssvkernel')
+           'ssvkernel',
+           'binnedkernel')
@@ -0,0 +1,113 @@
+"""
+Optional Numba-compiled versions of the hot loops of ssvkernel and mean.
+
+The kernels are compiled the first time kernels() is called, when Numba is
+installed. Without Numba, or with the environment variable
+ADAPTIVEKDE_NUMBA=0, kernels() returns None and the callers keep using their
+NumPy code. Numba is imported on that first call, not when adaptivekde is
+imported, since it takes longer to import than the rest of the analysis.
+"""
+
+import os
+import math
+
+# window functions of ssvkernel, by the index the compiled kernels take
+WINDOWS = {'Gauss': 0, 'Laplace': 1, 'Cauchy': 2, 'Boxcar': 3}
+
+_kernels = False
+
+
+def kernels():
+    """
+    Returns the compiled kernels, or None if Numba is not available.
+
+    Returns
+    -------
+    kernels : types.SimpleNamespace or None
+        kernel_regression(t, optwv, g, window) : the Nadaraya-Watson
+            regression of the bandwidths in ssvkernel.CostFunction.
+        balloon(t, t_nz, weights, optwp) : the balloon estimator in
+            ssvkernel.CostFunction.
+        mean_shift_gauss(x, k, h, epsilon_error) : mean.mean_shift with the
+            Gaussian kernel, updates k in place.
+    """
+    global _kernels
+    if _kernels is False:
+        _kernels = None
+        if os.environ.get('ADAPTIVEKDE_NUMBA', '1') != '0':
+            try:
+                _kernels = _compile()
+            except ImportError:
+                pass
+    return _kernels
+
+
+def _compile():
+    import types
+    import numpy as np
+    from numba import njit, prange
+
+    # cache=True keeps the compiled code in __pycache__, so later runs and
+    # the worker processes of the analysis don't compile again. The numpy
+    # error model gives inf/nan on division by zero, like the NumPy code.
+    jit = njit(cache=True, error_model='numpy')
+    pjit = njit(cache=True, error_model='numpy', parallel=True)
+
+    @jit
+    def window(x, w, kind):
+        # same formulas as ssvkernel.Gauss, Laplace, Cauchy and Boxcar
+        if kind == 0:
+            return 1 / (2 * math.pi)**2 / w * math.exp(-x**2 / 2 / w**2)
+        elif kind == 1:
+            return 1 / 2**0.5 / w * math.exp(-(2**0.5) / w / abs(x))
+        elif kind == 2:
+            return 1 / (math.pi * w * (1 + (x / w)**2))
+        else:
+            a = 12**0.5 * w
+            return 0.0 if abs(x) > a / 2 else 1 / a
+
+    @pjit
+    def kernel_regression(t, optwv, g, kind):
+        L = t.size
+        optwp = np.empty(L)
+        for i in prange(L):
+            numerator = 0.0
+            denominator = 0.0
+            for j in range(L):
+                z = window(t[i] - t[j], optwv[j] / g, kind)
+                numerator += optwv[j] * z
+                denominator += z
+            optwp[i] = numerator / denominator
+        return optwp
+
+    @pjit
+    def balloon(t, t_nz, weights, optwp):
+        L = t.size
+        yv = np.empty(L)
+        for i in prange(L):
+            total = 0.0
+            for j in range(t_nz.size):
+                total += weights[j] * window(t[i] - t_nz[j], optwp[i], 0)
+            yv[i] = total
+        return yv
+
+    @pjit
+    def mean_shift_gauss(x, k, h, epsilon_error):
+        error = epsilon_error + 1
+        shifts = np.empty(k.size)
+        while error >= epsilon_error:
+            for ki in prange(k.size):
+                numerator = 0.0
+                denominator = 0.0
+                for j in range(x.size):
+                    dk = math.exp(-0.5 * ((k[ki] - x[j]) / h)**2)
+                    numerator += dk * x[j]
+                    denominator += dk
+                shifts[ki] = numerator / denominator - k[ki]
+                k[ki] += shifts[ki]
+            error = np.sum(np.abs(shifts))
+        return k
+
+    return types.SimpleNamespace(kernel_regression=kernel_regression,
+                                 balloon=balloon,
+                                 mean_shift_gauss=mean_shift_gauss)
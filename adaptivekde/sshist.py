@@ -50,34 +50,51 @@ def sshist(x, N=np.arange(2, 501, 1), SN=30):
     x_min = np.min(x)
     x_max = np.max(x)
 
-    # get smallest difference 'dx' between all pairwise samples
-    buf = np.abs(np.diff(np.sort(x)))
-    dx = min(buf[buf > 0])
-
     # setup bins to evaluate
     #N_MIN = max(2, min(N))
     #N_MAX = min(np.floor((x_max - x_min) / (2*dx)), max(N))
     #N = list(range(N_MIN, N_MAX+1))
+    N = np.asarray(N)
     D = (x_max - x_min) / N
 
-    # compute cost function over each possible number of bins
-    Cs = np.zeros((len(N), SN))
-    for i, n in enumerate(N):  # loop over number of bins
-        shift = np.linspace(0, D[i], SN)
-        for p, sh in enumerate(shift):  # loop over shift window positions
-
-            # define bin edges
-            edges = np.linspace(x_min + sh - D[i]/2,
-                                x_max + sh - D[i]/2, N[i]+1)
+    # the counts of every (N, shift) histogram are read off the sorted data
+    # with one searchsorted call instead of calling np.histogram per pair
+    xs = np.sort(np.ravel(x))
+
+    # shift window positions for every N, rows as np.linspace(0, D[i], SN)
+    shift = np.linspace(0, D, SN, axis=-1)
+
+    # first and last edge of every histogram, flattened in (N, shift) order
+    n = np.repeat(N, SN)
+    start = (x_min + shift - (D/2)[:, None]).ravel()
+    stop = (x_max + shift - (D/2)[:, None]).ravel()
+
+    # define bin edges; this repeats the arithmetic of
+    # np.linspace(start, stop, n+1) so the edges are identical
+    offset = np.concatenate(([0], np.cumsum(n + 1)))
+    j = np.arange(offset[-1]) - np.repeat(offset[:-1], n + 1)
+    step = np.repeat((stop - start) / n, n + 1)
+    edges = j * step + np.repeat(start, n + 1)
+    last = offset[1:] - 1
+    edges[last] = stop
+
+    # count number of events in these bins, the way np.histogram does:
+    # left-closed bins, except the last one which also includes its right edge
+    cum = xs.searchsorted(edges, 'left')
+    cum[last] = xs.searchsorted(edges[last], 'right')
+    counts = np.delete(np.diff(cum), last[:-1])
+
+    # get mean and variance of events. The squared deviations of the SN
+    # histograms with N[i] bins are summed as the rows of an (SN, N[i])
+    # block, which adds them in the same order as np.sum per histogram
+    k = (cum[last] - cum[offset[:-1]]) / n
+    dev = (counts - np.repeat(k, n))**2
+    block = np.concatenate(([0], np.cumsum(N * SN)))
+    v = np.concatenate([dev[block[i]:block[i+1]].reshape(SN, N[i]).sum(axis=1)
+                        for i in range(len(N))]) / n
 
-            # count number of events in these bins
-            ki = np.histogram(x, edges)
-
-            # get mean and variance of events
-            k = ki[0].mean()
-            v = np.sum((ki[0] - k)**2) / N[i]
-
-            Cs[i, p] = (2*k - v) / D[i]**2
+    # compute cost function over each possible number of bins
+    Cs = ((2*k - v) / np.repeat(D, SN)**2).reshape(len(N), SN)
 
     # average over shift window
     C = Cs.mean(axis=1)
@@ -22,7 +22,7 @@ def sskernel(x, tin=None, W=None, nbs=1e3):
         smaller than the sampling resolution of 'x'.
     nbs : int, optional
         The number of bootstrap samples to use in estimating the [0.05, 0.95]
-        confidence interval of the output 'y'
+        confidence interval of the output 'y'. 0 skips the bootstrap.
 
     Returns
     -------
@@ -39,10 +39,10 @@ def sskernel(x, tin=None, W=None, nbs=1e3):
     confb95 : array_like
         The 5% and 95% confidence interval of the kernel density estimate 'y'.
         Has dimensions 2 x len(y). confb95[0,:] corresponds to the 5% interval,
-        and confb95[1,:] corresponds to the 95% interval.
+        and confb95[1,:] corresponds to the 95% interval. None if nbs is 0.
     yb : array_like
         The bootstrap samples used in estimating confb95. Each row corresponds
-        to one bootstrap sample.
+        to one bootstrap sample. None if nbs is 0.
 
     See Also
     --------
@@ -60,7 +60,7 @@ def sskernel(x, tin=None, W=None, nbs=1e3):
         T = np.max(x) - np.min(x)
         dx = np.sort(np.diff(np.sort(x)))
         dt_samp = dx[np.nonzero(dx)][0]
-        tin = np.linspace(np.min(x), np.max(x), min(np.ceil(T / dt_samp).astype(np.int), np.int(1e3)))
+        tin = np.linspace(np.min(x), np.max(x), min(np.ceil(T / dt_samp).astype(int), int(1e3)))
         t = tin
         x_ab = x[(x >= min(tin)) & (x <= max(tin))]
     else:
@@ -79,7 +79,7 @@ def sskernel(x, tin=None, W=None, nbs=1e3):
     # create the finest histogram
     thist = np.concatenate((t, (t[-1]+dt)[np.newaxis]))
     y_hist = np.histogram(x_ab, thist-dt/2)[0]
-    N = sum(y_hist).astype(np.float)
+    N = sum(y_hist).astype(float)
     y_hist = y_hist / N / dt
 
     # global search if input 'W' is defined
@@ -135,21 +135,25 @@ def sskernel(x, tin=None, W=None, nbs=1e3):
         C = C[0:k]
         W = W[0:k]
 
-    # estimate confidence intervals by bootstrapping
-    nbs = np.asarray(nbs, dtype=np.int)
-    yb = np.zeros((nbs, len(tin)))
-    for i in range(nbs):
-        idx = np.random.randint(0, len(x_ab)-1, len(x_ab))
-        xb = x_ab[idx]
+    # estimate confidence intervals by bootstrapping. Resampling x_ab with
+    # replacement and binning it is a multinomial draw over the bins of the
+    # finest histogram, so all resamples are drawn and smoothed at once.
+    nbs = int(nbs)
+    if nbs > 0:
         thist = np.concatenate((t, (t[-1]+dt)[np.newaxis]))
-        y_histb = np.histogram(xb, thist - dt / 2)[0] / dt / N
+        n_hist = np.histogram(x_ab, thist - dt / 2)[0]
+        y_histb = np.random.multinomial(np.sum(n_hist), n_hist / np.sum(n_hist),
+                                        nbs) / dt / N
         yb_buf = fftkernel(y_histb, optw / dt)
-        yb_buf = yb_buf / np.sum(yb_buf * dt)
-        yb[i, ] = np.interp(tin, t, yb_buf)
-    ybsort = np.sort(yb, axis=0)
-    y95b = ybsort[np.int(np.floor(0.05 * nbs)), :]
-    y95u = ybsort[np.int(np.floor(0.95 * nbs)), :]
-    confb95 = np.concatenate((y95b[np.newaxis], y95u[np.newaxis]), axis=0)
+        yb_buf = yb_buf / np.sum(yb_buf * dt, axis=1)[:, np.newaxis]
+        yb = np.array([np.interp(tin, t, yb_row) for yb_row in yb_buf])
+        ybsort = np.sort(yb, axis=0)
+        y95b = ybsort[int(np.floor(0.05 * nbs)), :]
+        y95u = ybsort[int(np.floor(0.95 * nbs)), :]
+        confb95 = np.concatenate((y95b[np.newaxis], y95u[np.newaxis]), axis=0)
+    else:
+        confb95 = None
+        yb = None
 
     # return outputs
     y = np.interp(tin, t, y)
@@ -173,22 +177,23 @@ def CostFunction(y_hist, N, w, dt):
 
 def fftkernel(x, w):
 
-    L = x.size
+    # smooths along the last axis, so a stack of histograms is one call
+    L = x.shape[-1]
     Lmax = L + 3 * w
     n = 2 ** np.ceil(np.log2(Lmax))
-    n = n.astype(np.int)
+    n = n.astype(int)
 
-    X = np.fft.fft(x, n.astype(np.int))
+    X = np.fft.fft(x, n.astype(int))
 
     f = np.linspace(0, n-1, n) / n
-    f = np.concatenate((-f[0: np.int(n / 2 + 1)],
-                        f[1: np.int(n / 2 - 1 + 1)][::-1]))
+    f = np.concatenate((-f[0: int(n / 2 + 1)],
+                        f[1: int(n / 2 - 1 + 1)][::-1]))
 
     K = np.exp(-0.5 * (w * 2 * np.pi * f) ** 2)
 
     y = np.real(np.fft.ifft(X * K, n))
 
-    y = y[0:L]
+    y = y[..., 0:L]
 
     return y
 
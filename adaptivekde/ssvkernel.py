@@ -1,7 +1,9 @@
 import numpy as np
 
+from . import jit
 
-def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
+
+def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar', chunk=None):
     """
     Generates a locally adaptive kernel-density estimate for one-dimensional
     data.
@@ -34,11 +36,15 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
         The number of window sizes to evaluate. Default value = 80.
     nbs : int, optional
         The number of bootstrap samples to use in estimating the [0.05, 0.95]
-        confidence interval of the output 'y'.
+        confidence interval of the output 'y'. 0 skips the bootstrap.
     WinFunc : string, optional
         The type of window function to use in estimating local bandwidth.
         Choose from one of 'Boxcar', 'Laplace', 'Cauchy' and 'Gauss'. Default
         value = 'Gauss'.
+    chunk : int, optional
+        The number of grid points evaluated at once in the cost function.
+        Bounds the memory of the intermediate chunk x L kernel matrices.
+        Default value = None, which evaluates the whole grid at once.
 
     Returns
     -------
@@ -55,10 +61,10 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
     confb95 : array_like
         The 5% and 95% confidence interval of the kernel density estimate 'y'.
         Has dimensions 2 x len(y). confb95[0,:] corresponds to the 5% interval,
-        and confb95[1,:] corresponds to the 95% interval.
+        and confb95[1,:] corresponds to the 95% interval. None if nbs is 0.
     yb : array_like
         The bootstrap samples used in estimating confb95. Each row corresponds
-        to one bootstrap sample.
+        to one bootstrap sample. None if nbs is 0.
 
     See Also
     --------
@@ -76,7 +82,7 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
         T = np.max(x) - np.min(x)
         dx = np.sort(np.diff(np.sort(x)))
         dt_samp = dx[np.nonzero(dx)][0]
-        tin = np.linspace(np.min(x), np.max(x), min(np.ceil(T / dt_samp).astype(np.int), int(1e3)))
+        tin = np.linspace(np.min(x), np.max(x), min(np.ceil(T / dt_samp).astype(int), int(1e3)))
         t = tin
         x_ab = x[(x >= min(tin)) & (x <= max(tin))]
     else:
@@ -85,7 +91,7 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
         dx = np.sort(np.diff(np.sort(x)))
         dt_samp = dx[np.nonzero(dx)][0]
         if dt_samp > min(np.diff(tin)):
-            t = np.linspace(min(tin), max(tin), min(np.ceil(T / dt_samp).astype(np.int), 1e3))
+            t = np.linspace(min(tin), max(tin), min(np.ceil(T / dt_samp).astype(int), 1e3))
         else:
             t = tin
 
@@ -96,27 +102,27 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
     thist = np.concatenate((t, (t[-1]+dt)[np.newaxis]))
     y_hist = np.histogram(x_ab, thist-dt/2)[0] / dt
     L = y_hist.size
-    N = sum(y_hist * dt).astype(np.float)
+    N = sum(y_hist * dt).astype(float)
 
     # initialize window sizes
     W = logexp(np.linspace(ilogexp(5 * dt), ilogexp(T), M))
 
-    # compute local cost functions
+    # compute local cost functions, one batched transform per padded length
     c = np.zeros((M, L))
-    for j in range(M):
-        w = W[j]
-        yh = fftkernel(y_hist, w / dt)
-        c[j, :] = yh**2 - 2 * yh * y_hist + 2 / (2 * np.pi)**0.5 / w * y_hist
+    for n, j in fftgroups(L, W / dt):
+        yh = np.fft.irfft(np.fft.rfft(y_hist, n) *
+                          fftwindow(n, W[j] / dt, 'Gauss'), n)[:, 0:L]
+        c[j, :] = yh**2 - 2 * yh * y_hist + \
+            2 / (2 * np.pi)**0.5 / W[j, np.newaxis] * y_hist
 
     # initialize optimal ws
     optws = np.zeros((M, L))
-    for i in range(M):
-        Win = W[i]
-        C_local = np.zeros((M, L))
-        for j in range(M):
-            C_local[j, :] = fftkernelWin(c[j, :], Win / dt, WinFunc)
-        n = np.argmin(C_local, axis=0)
-        optws[i, :] = W[n]
+    for n, i in fftgroups(L, W / dt):
+        X = np.fft.rfft(c, n, axis=1)
+        K = fftwindow(n, W[i] / dt, WinFunc)
+        for m, Kw in zip(i, K):
+            C_local = np.fft.irfft(X * Kw, n, axis=1)[:, 0:L]
+            optws[m, :] = W[np.argmin(C_local, axis=0)]
 
     # golden section search for stiffness parameter of variable bandwidths
     k = 0
@@ -128,8 +134,8 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
     phi = (5**0.5 + 1) / 2
     c1 = (phi - 1) * a + (2 - phi) * b
     c2 = (2 - phi) * a + (phi - 1) * b
-    f1 = CostFunction(y_hist, N, t, dt, optws, W, WinFunc, c1)[0]
-    f2 = CostFunction(y_hist, N, t, dt, optws, W, WinFunc, c2)[0]
+    f1 = CostFunction(y_hist, N, t, dt, optws, W, WinFunc, c1, chunk)[0]
+    f2 = CostFunction(y_hist, N, t, dt, optws, W, WinFunc, c2, chunk)[0]
     while (np.abs(b-a) > tol * (abs(c1) + abs(c2))) & (k < 30):
         if f1 < f2:
             b = c2
@@ -137,7 +143,7 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
             c1 = (phi - 1) * a + (2 - phi) * b
             f2 = f1
             f1, yv1, optwp1 = CostFunction(y_hist, N, t, dt, optws, W,
-                                           WinFunc, c1)
+                                           WinFunc, c1, chunk)
             yopt = yv1 / np.sum(yv1 * dt)
             optw = optwp1
         else:
@@ -146,7 +152,7 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
             c2 = (2 - phi) * a + (phi - 1) * b
             f1 = f2
             f2, yv2, optwp2 = CostFunction(y_hist, N, t, dt, optws, W,
-                                           WinFunc, c2)
+                                           WinFunc, c2, chunk)
             yopt = yv2 / np.sum(yv2 * dt)
             optw = optwp2
 
@@ -159,27 +165,25 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
     gs = gs[0:k]
     C = C[0:k]
 
-    # estimate confidence intervals by bootstrapping
-    nbs = np.asarray(nbs, dtype=np.int)
-    yb = np.zeros((nbs, tin.size))
-    for i in range(nbs):
-        Nb = np.random.poisson(lam=N)
-        idx = np.random.randint(0, N, Nb)
-        xb = x_ab[idx]
-        thist = np.concatenate((t, (t[-1]+dt)[np.newaxis]))
-        y_histb = np.histogram(xb, thist - dt / 2)[0]
-        idx = y_histb.nonzero()
-        y_histb_nz = y_histb[idx]
-        t_nz = t[idx]
-        yb_buf = np.zeros((L, ))
-        for k in range(L):
-            yb_buf[k] = np.sum(y_histb_nz * Gauss(t[k] - t_nz, optw[k])) / Nb
-        yb_buf = yb_buf / np.sum(yb_buf * dt)
-        yb[i, :] = np.interp(tin, t, yb_buf)
-    ybsort = np.sort(yb, axis=0)
-    y95b = ybsort[np.int(np.floor(0.05 * nbs)), :]
-    y95u = ybsort[np.int(np.floor(0.95 * nbs)), :]
-    confb95 = np.concatenate((y95b[np.newaxis], y95u[np.newaxis]), axis=0)
+    # estimate confidence intervals by bootstrapping. A Poisson number of
+    # resamples drawn with replacement gives independent Poisson bin counts,
+    # so all resampled histograms are drawn at once and smoothed with one
+    # product against the L x L matrix of the optimized local kernels.
+    nbs = int(nbs)
+    if nbs > 0:
+        y_histb = np.random.poisson(y_hist * dt, (nbs, L))
+        Nb = np.sum(y_histb, axis=1)
+        K = Gauss(t[:, np.newaxis] - t, optw[:, np.newaxis])
+        yb_buf = y_histb @ K.T / Nb[:, np.newaxis]
+        yb_buf = yb_buf / np.sum(yb_buf * dt, axis=1)[:, np.newaxis]
+        yb = np.array([np.interp(tin, t, yb_row) for yb_row in yb_buf])
+        ybsort = np.sort(yb, axis=0)
+        y95b = ybsort[int(np.floor(0.05 * nbs)), :]
+        y95u = ybsort[int(np.floor(0.95 * nbs)), :]
+        confb95 = np.concatenate((y95b[np.newaxis], y95u[np.newaxis]), axis=0)
+    else:
+        confb95 = None
+        yb = None
 
     # return outputs
     y = np.interp(tin, t, yopt)
@@ -189,41 +193,53 @@ def ssvkernel(x, tin=None, M=80, nbs=1e2, WinFunc='Boxcar'):
     return y, t, optw, gs, C, confb95, yb
 
 
-def CostFunction(y_hist, N, t, dt, optws, WIN, WinFunc, g):
+def CostFunction(y_hist, N, t, dt, optws, WIN, WinFunc, g, chunk=None):
 
     L = y_hist.size
-    optwv = np.zeros((L, ))
-    for k in range(L):
-        gs = optws[:, k] / WIN
-        if g > np.max(gs):
-            optwv[k] = np.min(WIN)
-        else:
-            if g < min(gs):
-                optwv[k] = np.max(WIN)
-            else:
-                idx = np.max(np.nonzero(gs >= g))
-                optwv[k] = g * WIN[idx]
-
-    # Nadaraya-Watson kernel regression
-    optwp = np.zeros((L, ))
-    for k in range(L):
+    if chunk is None:
+        chunk = L
+
+    # variable bandwidth: the largest window whose stiffness gs still
+    # exceeds g, clipped to the smallest/largest window outside the range
+    gs = optws / WIN[:, np.newaxis]
+    idx = gs.shape[0] - 1 - np.argmax((gs >= g)[::-1], axis=0)
+    optwv = g * WIN[idx]
+    optwv[g < np.min(gs, axis=0)] = np.max(WIN)
+    optwv[g > np.max(gs, axis=0)] = np.min(WIN)
+
+    # Nadaraya-Watson kernel regression, evaluated in blocks of grid points,
+    # or by the compiled loops of jit.py if Numba is installed
+    compiled = jit.kernels()
+    if compiled is not None:
+        optwp = compiled.kernel_regression(t, optwv, g,
+                                           jit.WINDOWS.get(WinFunc, 0))
+    else:
         if WinFunc == 'Boxcar':
-            Z = Boxcar(t[k]-t, optwv / g)
+            Window = Boxcar
         elif WinFunc == 'Laplace':
-            Z = Laplace(t[k]-t, optwv / g)
+            Window = Laplace
         elif WinFunc == 'Cauchy':
-            Z = Cauchy(t[k]-t, optwv / g)
+            Window = Cauchy
         else:  # WinFunc == 'Gauss'
-            Z = Gauss(t[k]-t, optwv / g)
-        optwp[k] = np.sum(optwv * Z) / np.sum(Z)
+            Window = Gauss
+        optwp = np.zeros((L, ))
+        for k in range(0, L, chunk):
+            Z = Window(t[k:k+chunk, np.newaxis] - t, optwv / g)
+            optwp[k:k+chunk] = np.sum(optwv * Z, axis=1) / np.sum(Z, axis=1)
 
     # speed-optimized baloon estimator
     idx = y_hist.nonzero()
     y_hist_nz = y_hist[idx]
     t_nz = t[idx]
-    yv = np.zeros((L, ))
-    for k in range(L):
-        yv[k] = np.sum(y_hist_nz * dt * Gauss(t[k]-t_nz, optwp[k]))
+    if compiled is not None:
+        yv = compiled.balloon(t, t_nz, y_hist_nz * dt, optwp)
+    else:
+        yv = np.zeros((L, ))
+        for k in range(0, L, chunk):
+            yv[k:k+chunk] = np.sum(y_hist_nz * dt *
+                                   Gauss(t[k:k+chunk, np.newaxis] - t_nz,
+                                         optwp[k:k+chunk, np.newaxis]),
+                                   axis=1)
     yv = yv * N / np.sum(yv * dt)
 
     # cost function of estimated kernel
@@ -238,15 +254,15 @@ def fftkernel(x, w):
     L = x.size
     Lmax = L + 3 * w
     # n = 2 ** np.ceil(np.log2(Lmax))
-    # X = np.fft.fft(x, n.astype(np.int))
+    # X = np.fft.fft(x, n.astype(int))
     n = 2 ** np.ceil(np.log2(Lmax))
-    n = n.astype(np.int)
+    n = n.astype(int)
     X = np.fft.fft(x, n)
 
     # generate kernel domain
     f = np.linspace(0, n-1, n) / n
-    f = np.concatenate((-f[0: np.int(n / 2 + 1)],
-                        f[1: np.int(n / 2 - 1 + 1)][::-1]))
+    f = np.concatenate((-f[0: int(n / 2 + 1)],
+                        f[1: int(n / 2 - 1 + 1)][::-1]))
 
     # evaluate kernel
     K = np.exp(-0.5 * (w * 2 * np.pi * f) ** 2)
@@ -263,15 +279,15 @@ def fftkernelWin(x, w, WinFunc):
     L = x.size
     Lmax = L + 3 * w
     # n = 2 ** np.ceil(np.log2(Lmax))
-    # X = np.fft.fft(x, n.astype(np.int))
+    # X = np.fft.fft(x, n.astype(int))
     n = 2 ** np.ceil(np.log2(Lmax))
-    n = n.astype(np.int)
+    n = n.astype(int)
     X = np.fft.fft(x, n)
 
     # generate kernel domain
     f = np.linspace(0, n-1, n) / n
-    f = np.concatenate((-f[0: np.int(n / 2 + 1)],
-                        f[1: np.int(n / 2 - 1 + 1)][::-1]))
+    f = np.concatenate((-f[0: int(n / 2 + 1)],
+                        f[1: int(n / 2 - 1 + 1)][::-1]))
     t = 2 * np.pi * f
 
     # determine window function - evaluate kernel
@@ -294,6 +310,36 @@ def fftkernelWin(x, w, WinFunc):
     return y
 
 
+def fftgroups(L, w):
+    # group the kernel widths 'w' by the padded transform length that
+    # fftkernel/fftkernelWin would use for each of them
+    n = 2 ** np.ceil(np.log2(L + 3 * w)).astype(int)
+    for m in np.unique(n):
+        yield m, np.nonzero(n == m)[0]
+
+
+def fftwindow(n, w, WinFunc):
+    # spectra of the window functions of fftkernelWin for all widths 'w'
+    # at once, on the non-negative frequencies of an n-point rfft
+    f = np.arange(n // 2 + 1) / n
+    t = 2 * np.pi * f
+    w = np.asarray(w, dtype=float)[:, np.newaxis]
+
+    if WinFunc == 'Boxcar':
+        a = 12**0.5 * w
+        with np.errstate(divide='ignore', invalid='ignore'):
+            K = 2 * np.sin(a * t / 2) / (a * t)
+        K[:, 0] = 1
+    elif WinFunc == 'Laplace':
+        K = 1 / (1 + (w * t)**2 / 2)
+    elif WinFunc == 'Cauchy':
+        K = np.exp(-w * t)
+    else:  # WinFunc == 'Gauss'
+        K = np.exp(-0.5 * (w * t)**2)
+
+    return K
+
+
 def Gauss(x, w):
     y = 1 / (2 * np.pi)**2 / w * np.exp(-x**2 / 2 / w**2)
     return y
@@ -311,8 +357,7 @@ def Cauchy(x, w):
 
 def Boxcar(x, w):
     a = 12**0.5 * w
-    y = 1 / a
-    y[np.abs(x) > a / 2] = 0
+    y = np.where(np.abs(x) > a / 2, 0, 1 / a)
     return y
 
 
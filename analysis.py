@@ -1,132 +1,428 @@
-import re
 import sys
 import numpy as np
 import config as c
-import plots
+import filecache
+import resultcache
+import export
+import fit
 import os.path
 
 from pandas import read_csv
 from os import getcwd
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, FIRST_COMPLETED
+from concurrent.futures import wait as waitForFutures
+from collections import deque
+from multiprocessing import get_context
 from dataclass import Data
-from dataclasses import asdict
+from concentration import ConcentrationResolver
+from timings import Timings, TimingsSection
 from datetime import date, datetime
 
 
-# Function to load data from data_good.txt files.
-def FileLoader(rootDir, blacklist, blacklistConc):
+# Function to read a single data_good.txt file. Column 0 holds the RMS values and is always read.
+# Other columns are only parsed when asked for in columns ({name: column index}). Columns that only hold whole numbers,
+# such as the bead index in column 4, are returned as integer arrays.
+def ReadDataGood(dataLocation, columns=None):
+	if columns == None:
+		columns = {}
+	usecols = sorted(set([0] + list(columns.values())))
 
-	# Regex function to find concentrations from the directory name
-	def concentrationRegex(subdir):
-		regexConcentration = re.findall(r"(\d+[.,]?\d*)(?:[\s_-]*)(?:nM)", os.path.basename(os.path.normpath(subdir)), flags = re.I)
+	# The columns are separated by runs of spaces. r"\s+" is handled by pandas' C parser, unlike any other regex delimiter.
+	df = read_csv(dataLocation, sep=r"\s+", index_col=None, header=None, usecols=usecols, dtype=np.float64, engine="c")
 
-		# If nothing was found, check milli Molar
-		if not regexConcentration:
-			regexConcentration = re.findall(r"(\d+[.,]?\d*)(?:[\s_-]*)(?:mM)", os.path.basename(os.path.normpath(subdir)), flags = re.I)
+	extraColumns = {}
+	for name, index in columns.items():
+		column = df[index].to_numpy()
+		if np.array_equal(column, np.round(column)):
+			column = column.astype(np.int64)
+		extraColumns[name] = column
 
-			# If nothing was found, ask the user to specify concentration
-			if not regexConcentration:
-				print("Couldn't find matching expression for " + subdir)
-				print("Enter the concentration in nM:")
-				regexConcentration = []
-				input_concentration = input()
-				regexConcentration.append(input_concentration)
-			else:
-				print("Found concentration in " + subdir + ": " + regexConcentration[0] + "mM")
-				regexConcentration = regexConcentration * 1000
-		else:
-			print("Found concentration in " + subdir + ": " + regexConcentration[0] + "nM")
-		return float(regexConcentration[0])
+	return df[0].to_numpy(), extraColumns
 
 
-	skipBoolean = False
-	concList, dataList, pathList = [], [], []
-	rootDirName = os.path.basename(os.path.normpath(rootDir))
-	
-	# Iterate over all sub-directories; directories; and files of the root-directory, find data_good.txt files and determine concentrations.
-	for subdir, dirs, files in os.walk(rootDir):
-		filesSet = set(files)
-		if "data_good.txt" in filesSet:
-			
-			# If user specified blacklist, check if current data_good.txt is located in a blacklisted folder
-			if blacklist != None:	
-				for blacklistPath in blacklist:
-					if os.path.commonpath([subdir, blacklistPath]) == os.path.normpath(blacklistPath):
-						skipBoolean = True
-						print("  " + subdir + " ignored because it is in blacklistPath")
-				if skipBoolean == True:
-					skipBoolean = False
-					continue
-
-			concentration = concentrationRegex(subdir)
-
-			# If user specified blacklisted concentrations, check if current concentration is blacklisted
-			if blacklistConc != None and (concentration in set(blacklistConc)):
-				print("  " + subdir + " ignored because" + str(concentration) + "nM is in blacklistConc")
+# Reads a data_good.txt file through the sidecar cache in cacheDir. Unchanged files are loaded from the cache, new or
+# modified files are parsed and added to it.
+def ReadDataGoodCached(dataLocation, columns, cacheDir, hashContent=False):
+	key = filecache.fileKey(dataLocation, columns or {}, hashContent)
+	cached = filecache.load(cacheDir, dataLocation, key)
+	if cached != None:
+		return cached
+
+	rms, extraColumns = ReadDataGood(dataLocation, columns)
+	filecache.store(cacheDir, dataLocation, key, rms, extraColumns)
+	return rms, extraColumns
+
+
+# Normalized absolute path, used to compare folders with the blacklist
+def NormalizePath(path):
+	return os.path.normcase(os.path.abspath(path))
+
+
+# Returns the folders below rootDir (rootDir included) that hold a data_good.txt file, in the same order as os.walk, and
+# the blacklisted folders that were skipped. Blacklisted folders are not entered at all, so their subfolders are never listed.
+# With threads > 1, the folders directly below rootDir are scanned in parallel; the results keep the same order.
+def ScanDataDirs(rootDir, blacklist=None, threads=1):
+	blacklistSet = set(NormalizePath(blacklistPath) for blacklistPath in (blacklist or []))
+
+	# Reads one folder and returns whether it holds a data_good.txt file and its subfolders. Symbolic links to folders
+	# are not followed, like os.walk. Folders that can't be read are skipped, like os.walk.
+	def scanDir(directory):
+		found, subdirs = False, []
+		try:
+			with os.scandir(directory) as entries:
+				for entry in entries:
+					if entry.is_dir(follow_symlinks = False):
+						subdirs.append(entry.path)
+					elif entry.name == "data_good.txt" and not entry.is_dir():
+						found = True
+		except OSError:
+			pass
+		return found, subdirs
+
+	# Depth first, in the order the folders are listed
+	def scanTree(top):
+		dataDirs, ignored = [], []
+		stack = [top]
+		while stack:
+			directory = stack.pop()
+			if blacklistSet and NormalizePath(directory) in blacklistSet:
+				ignored.append(directory)
 				continue
+			found, subdirs = scanDir(directory)
+			if found:
+				dataDirs.append(directory)
+			stack.extend(reversed(subdirs))
+		return dataDirs, ignored
+
+	# A root folder inside a blacklisted folder has nothing to scan
+	root = NormalizePath(rootDir)
+	if any(root == blacklistPath or root.startswith(os.path.join(blacklistPath, "")) for blacklistPath in blacklistSet):
+		return [], [rootDir]
+
+	if threads <= 1:
+		return scanTree(rootDir)
+
+	found, subdirs = scanDir(rootDir)
+	dataDirs, ignored = ([rootDir] if found else []), []
+	with ThreadPoolExecutor(max_workers = threads) as executor:
+		for subdirData, subdirIgnored in executor.map(scanTree, subdirs):
+			dataDirs.extend(subdirData)
+			ignored.extend(subdirIgnored)
+	return dataDirs, ignored
+
+
+# Function to find the data_good.txt files in rootDir and determine their concentrations.
+# Returns a list of ([root folder, dir, file] path, data_good.txt location, concentration), in the order os.walk finds them.
+# threads sets the number of threads that scan the folders below rootDir, see ScanDataDirs.
+# The concentrations are resolved by resolver (see concentration.py). Folders without a concentration are skipped and
+# collected in resolver.unresolved.
+def FindDataFiles(rootDir, blacklist, blacklistConc, threads=1, resolver=None):
+	if resolver == None:
+		resolver = ConcentrationResolver(rootDir)
+
+	dataFiles = []
+	rootDirName = os.path.basename(os.path.normpath(rootDir))
+
+	# Find the folders with data_good.txt files. Blacklisted folders are skipped with everything in them.
+	dataDirs, ignored = ScanDataDirs(rootDir, blacklist, threads)
+	for subdir in ignored:
+		print("  " + subdir + " ignored because it is in blacklistPath")
+
+	# Determine the concentrations
+	for subdir in dataDirs:
+		concentration, source = resolver.resolve(subdir)
+		if concentration == None:
+			print("  " + subdir + " skipped because its concentration was not found")
+			continue
+		print("Found concentration in " + subdir + ": " + format(concentration, "g") + "nM" + ("" if source == "folder name" else " (" + source + ")"))
+
+		# If user specified blacklisted concentrations, check if current concentration is blacklisted
+		if blacklistConc != None and (concentration in set(blacklistConc)):
+			print("  " + subdir + " ignored because" + str(concentration) + "nM is in blacklistConc")
+			continue
+
+		dataLocation = subdir + "/data_good.txt"
+		fileName = os.path.basename(os.path.normpath(subdir))
+		dirName = os.path.dirname(os.path.relpath(subdir, rootDir))
+		dataFiles.append((np.asarray([rootDirName,dirName,fileName]), dataLocation, concentration))
+
+	return dataFiles
 
-			dataLocation = subdir + "/data_good.txt"
-			fileName = os.path.basename(os.path.normpath(subdir))
-			dirName = os.path.dirname(os.path.relpath(subdir, rootDir))
-			df = read_csv(dataLocation, delimiter=r"\s+\s+", index_col=None, header = None, engine="python")
 
-			concList.append(concentration)
-			dataList.append(df[0].to_numpy())
-			pathList.append([rootDirName,dirName,fileName])
+# Generator that parses the files found by FindDataFiles and yields (path, RMS values, concentration, extra columns)
+# in the same order. Up to prefetch files are parsed ahead on I/O threads while the caller works on the current one;
+# prefetch 0 parses every file when it is asked for. The time spent waiting for a file is timed as the ReadDataGood stage.
+# If cacheDir is given, parsed files are cached there (see filecache.py). cacheHash adds a hash of the file content to the cache key.
+def StreamDataFiles(files, columns=None, cacheDir=None, cacheHash=False, prefetch=2, timings=None):
+	if timings == None:
+		timings = Timings()
 
-	data = np.asarray(dataList, dtype = object)
+	def read(dataLocation):
+		if cacheDir != None:
+			return ReadDataGoodCached(dataLocation, columns, cacheDir, cacheHash)
+		return ReadDataGood(dataLocation, columns)
+
+	def wait(path, concentration, future):
+		with timings.stage("ReadDataGood"):
+			rms, extraColumns = future.result()
+		return path, rms, concentration, extraColumns
+
+	if prefetch == 0:
+		for path, dataLocation, concentration in files:
+			with timings.stage("ReadDataGood"):
+				rms, extraColumns = read(dataLocation)
+			yield path, rms, concentration, extraColumns
+		return
+
+	# Files are submitted in order and handed out in order, with at most prefetch files waiting in the queue
+	with ThreadPoolExecutor(max_workers = prefetch) as executor:
+		queue = deque()
+		for path, dataLocation, concentration in files:
+			queue.append((path, concentration, executor.submit(read, dataLocation)))
+			if len(queue) > prefetch:
+				yield wait(*queue.popleft())
+		while queue:
+			yield wait(*queue.popleft())
+
+
+# Function to load data from data_good.txt files into arrays, see FindDataFiles and StreamDataFiles.
+def FileLoader(rootDir, blacklist, blacklistConc, columns=None, cacheDir=None, cacheHash=False, timings=None, prefetch=2):
+	concList, dataList, pathList, columnsList = [], [], [], []
+	for path, rms, concentration, extraColumns in StreamDataFiles(FindDataFiles(rootDir, blacklist, blacklistConc), columns, cacheDir, cacheHash, prefetch, timings):
+		concList.append(concentration)
+		dataList.append(rms)
+		pathList.append(path)
+		columnsList.append(extraColumns)
+
+	# Filled element by element: np.asarray would make a 2D object array if all datasets happen to have the same length
+	data = np.empty(len(dataList), dtype = object)
+	for i in range(0, len(dataList)):
+		data[i] = dataList[i]
 	conc = np.asarray(concList)
 	path = np.asarray(pathList)
 
-	return data, conc, path
+	return data, conc, path, columnsList
 
 
-def SaveConfigs(dataList, path):
+# timings holds the stages of the run and datasetTimings the stages of every dataset. They are only added to the
+# export when the timings are enabled; the export is then written a second time to include how long the first write took.
+def SaveConfigs(dataList, path, timings=None, datasetTimings=None):
+	if timings == None:
+		timings = Timings()
+	if datasetTimings == None:
+		datasetTimings = {}
 
 	# Add the config to the export config
 	c.ExportConfig.update({"Config": c.Config.config})
 
-	# Add the dataClasses as dictionaries to the export config
-	dataDict = defaultdict(dict)
-	for dataClass in dataList:
-		name = dataClass.path[1] + "/" + dataClass.path[2]
-		dataDict["Data"][name] = asdict(dataClass)
-	c.ExportConfig.update(dataDict)
+	# Add the metadata of the dataClasses to the export config. Their arrays are saved in a separate binary file.
+	dataDict, arrays = export.SplitData(dataList)
+	c.ExportConfig.update({"Format": {"Version": export.FORMATVERSION, "Arrays": export.ARRAYFILE}, "Data": dataDict})
 
 	# Save the export config
-	c.ExportConfig.save(path)
-	c.Config.save(path)
+	with timings.stage("SaveConfigs"):
+		export.SaveArrays(arrays, path)
+		c.ExportConfig.save(path)
+		c.Config.save(path)
+
+	if timings.enabled:
+		c.ExportConfig.update({"Timings": TimingsSection(timings.stages, datasetTimings)})
+		c.ExportConfig.save(path)
 
 
 
+# Fits all datasets at once with the batched Levenberg-Marquardt of fit.py (FittingParam.Engine: batch).
+# The datasets are grouped by model, and the histograms of a group are padded to the same number of bins.
+# Fits that don't converge are redone one by one with curve_fit.
+def FitDatasets(dataList):
+	groups = {mode: [] for mode in fit.MODELS}
+	for d in dataList:
+		mode, p0 = d.fitGuess()
+		if mode != None:
+			groups[mode].append((d, p0))
+
+	for mode, group in groups.items():
+		if len(group) == 0:
+			continue
+		histograms = [d.histogram() for d, _ in group]
+		bins = max(len(histogram) for histogram, _ in histograms)
+		x, y, mask = np.zeros((len(group), bins)), np.zeros((len(group), bins)), np.zeros((len(group), bins), dtype=bool)
+		for i, (histogram, binCenters) in enumerate(histograms):
+			x[i, :len(binCenters)] = binCenters
+			y[i, :len(histogram)] = histogram
+			mask[i, :len(histogram)] = True
+
+		pOpt, pcov, converged = fit.batchFit(mode, x, y, [p0 for _, p0 in group], mask)
+		for i, (d, _) in enumerate(group):
+			if converged[i]:
+				d.setFit(mode, pOpt[i], pcov[i])
+			else:
+				d.fitData()
+
+
+# Analyse a single dataset: KDE, bins and fit. Used by the serial loop and by the worker processes.
+# With the batch fit engine the fit is left to FitDatasets.
+# Returns the data class and the timings of its stages (empty unless DataParam.Timings is enabled).
+def AnalyseDataset(path, rawData, concentration, extraColumns):
+	timings = Timings(c.Config.get("DataParam.Timings", False), c.Config.get("DataParam.TimingsMemory", False))
+	try:
+		d = Data(path, rawData, concentration, c.Config.get("DataParam.MinRMS"), c.Config.get("DataParam.MaxRMS"), extraColumns)
+		with timings.stage("generateKDE"):
+			d.generateKDE(c.Config.get("DataParam.KDE"))
+		with timings.stage("generateBinEdges"):
+			d.generateBinEdges()
+		if c.Config.get("FittingParam.Engine", "curve_fit") != "batch":
+			with timings.stage("fitData"):
+				d.fitData()
+		return d, timings.stages
+	finally:
+		timings.stop()
+
+
+# Lists the folders that were skipped because their concentration was not found
+def PrintUnresolved(unresolved):
+	print("No concentration found for " + str(len(unresolved)) + " folders, they were skipped:")
+	for subdir in unresolved:
+		print("  " + subdir)
+
+
+# Analyses every dataset under FileParam.RootDir and saves the export. Returns the output folder, or None when no dataset
+# was found.
 def DataAnalysis(config, progress):
 	# Initialize classes for our config and export config
 	c.Config(config)
 	c.ExportConfig()
 
-	# Import TPM data and construct data class instances
-	RawDataList, ConcentrationList, PathList = FileLoader(c.Config.get("FileParam.RootDir"), 
-		c.Config.get("FileParam.Blacklist"), c.Config.get("FileParam.BlacklistConc"))
-	DataList = []
-
-	percentage_step = 100/len(RawDataList)
-
-	for i in range(0,len(RawDataList)):
-		DataList.append(Data(PathList[i], RawDataList[i], ConcentrationList[i], c.Config.get("DataParam.MinRMS"), c.Config.get("DataParam.MaxRMS")))
-		DataList[i].generateKDE(c.Config.get("DataParam.KDE"))
-		DataList[i].generateBinEdges()
-		DataList[i].fitData()
-		progress.emit(int(percentage_step * (i+1)))
-
-	#Find and create a new output folder
-	cwd = getcwd()
-	i = 0
-	while True:
-		outputDir = cwd + "/output/" + DataList[0].path[0] + "/" + datetime.now().strftime("%Y-%m-%d--%H-%M-%S")
-		if os.path.exists(outputDir):
-			continue
-		else:
-			os.makedirs(outputDir)
-			break
+	# Parsed data_good.txt files are cached in output/<data folder>/cache if FileParam.Cache is enabled, and the results of
+	# every dataset in output/<data folder>/cache/results if DataParam.Cache is enabled
+	cacheRoot = getcwd() + "/output/" + os.path.basename(os.path.normpath(c.Config.get("FileParam.RootDir"))) + "/cache"
+	cacheDir = None
+	if c.Config.get("FileParam.Cache"):
+		cacheDir = cacheRoot
+	resultCacheDir = None
+	if c.Config.get("DataParam.Cache", False):
+		resultCacheDir = cacheRoot + "/results"
+
+	# Per-stage timings and peak memory, saved in the Timings section of the export if DataParam.Timings is enabled
+	timings = Timings(c.Config.get("DataParam.Timings", False), c.Config.get("DataParam.TimingsMemory", False))
+	try:
+		# Find the TPM data files. They are read while the datasets are analysed, see StreamDataFiles.
+		with timings.stage("FileLoader"):
+			resolver = ConcentrationResolver(c.Config.get("FileParam.RootDir"), c.Config.get("FileParam.ConcentrationMap"),
+				c.Config.get("FileParam.ConcentrationFile", "concentration.txt"), c.Config.get("FileParam.ConcentrationPatterns"))
+			files = FindDataFiles(c.Config.get("FileParam.RootDir"), c.Config.get("FileParam.Blacklist"), c.Config.get("FileParam.BlacklistConc"),
+				c.Config.get("FileParam.DiscoveryThreads", 1), resolver)
+		stream = StreamDataFiles(files, c.Config.get("FileParam.ExtraColumns"), cacheDir, c.Config.get("FileParam.CacheHash", False),
+			c.Config.get("FileParam.Prefetch", 2), timings)
+
+		# Nothing to analyse, e.g. when no folder has a concentration. No export is saved.
+		if len(files) == 0:
+			if resolver.unresolved:
+				c.ExportConfig.update({"Unresolved": resolver.unresolved})
+				PrintUnresolved(resolver.unresolved)
+			print("No datasets found in " + c.Config.get("FileParam.RootDir") + ", nothing was analysed")
+			return None
+
+		DataList = []
+		ResultList = [None] * len(files)
+		keys = [None] * len(files)
+		missing = []
+
+		percentage_step = 100/len(files)
+
+		configKey = None
+		if resultCacheDir != None:
+			configKey = resultcache.configKey()
+
+		# Returns the data class of a dataset found in the result cache, or None
+		def cachedResult(i, path, rawData, concentration, extraColumns):
+			if resultCacheDir == None:
+				return None
+			with timings.stage("ResultCache"):
+				keys[i] = resultcache.datasetKey(rawData, path, configKey)
+				cached = resultcache.load(resultCacheDir, keys[i])
+			if cached == None:
+				return None
+			d = Data(path, rawData, concentration, c.Config.get("DataParam.MinRMS"), c.Config.get("DataParam.MaxRMS"), extraColumns)
+			for name, value in cached.items():
+				setattr(d, name, value)
+			return (d, {})
+
+		# Every dataset is analysed as soon as it is read. Datasets found in the result cache are not analysed again.
+		# DataParam.Workers sets the number of processes. 1 (default) analyses the datasets one by one in this thread, 0 uses all cores.
+		workers = c.Config.get("DataParam.Workers", 1)
+		with timings.stage("Analysis"):
+			if workers == 1:
+				for i, (path, rawData, concentration, extraColumns) in enumerate(stream):
+					ResultList[i] = cachedResult(i, path, rawData, concentration, extraColumns)
+					if ResultList[i] == None:
+						missing.append(i)
+						ResultList[i] = AnalyseDataset(path, rawData, concentration, extraColumns)
+					progress.emit(int(percentage_step * (i+1)))
+			else:
+				# Worker processes don't share our class-level config, so hand it to every worker explicitly when it starts.
+				# Spawn instead of fork: forking from the GUI's QThread is not safe, and spawn is what Windows does anyway.
+				# Reading is faster than analysing, so at most two datasets per worker are handed to the pool at a time.
+				# Otherwise every raw dataset would wait in the pool's queue at once.
+				maxPending = 2 * (workers or os.cpu_count() or 1)
+				with ProcessPoolExecutor(max_workers = workers or None, mp_context = get_context("spawn"), initializer = c.Config, initargs = (c.Config.config,)) as executor:
+					futures, pending = {}, set()
+					finished = 0
+					for i, (path, rawData, concentration, extraColumns) in enumerate(stream):
+						ResultList[i] = cachedResult(i, path, rawData, concentration, extraColumns)
+						if ResultList[i] == None:
+							missing.append(i)
+							# Count the datasets that are done, and wait for one when the pool is full
+							done, pending = waitForFutures(pending, timeout = 0 if len(pending) < maxPending else None, return_when = FIRST_COMPLETED)
+							finished += len(done)
+							futures[i] = executor.submit(AnalyseDataset, path, rawData, concentration, extraColumns)
+							pending.add(futures[i])
+						else:
+							finished += 1
+						progress.emit(int(percentage_step * finished))
+					for future in as_completed(pending):
+						finished += 1
+						progress.emit(int(percentage_step * finished))
+					# Collect in submission order so the export is identical to the serial path
+					for i, future in futures.items():
+						ResultList[i] = future.result()
+
+		if resultCacheDir != None:
+			print("Result cache: " + str(len(files) - len(missing)) + " hits, " + str(len(missing)) + " misses")
+
+		DataList = [d for d, _ in ResultList]
+		datasetTimings = {DataList[i].path[1] + "/" + DataList[i].path[2]: ResultList[i][1] for i in missing}
+
+		# FittingParam.Engine: curve_fit (default) fits every dataset on its own above, batch fits all datasets together here
+		if c.Config.get("FittingParam.Engine", "curve_fit") == "batch":
+			with timings.stage("FitDatasets"):
+				FitDatasets([DataList[i] for i in missing])
+
+		if resultCacheDir != None:
+			with timings.stage("ResultCache"):
+				for i in missing:
+					resultcache.store(resultCacheDir, keys[i], DataList[i])
+
+		#Find and create a new output folder
+		cwd = getcwd()
+		i = 0
+		while True:
+			outputDir = cwd + "/output/" + DataList[0].path[0] + "/" + datetime.now().strftime("%Y-%m-%d--%H-%M-%S")
+			if os.path.exists(outputDir):
+				continue
+			else:
+				os.makedirs(outputDir)
+				break
+
+		# Folders without a concentration were skipped. They are listed in the export and at the end of the run.
+		if resolver.unresolved:
+			c.ExportConfig.update({"Unresolved": resolver.unresolved})
+
+		SaveConfigs(DataList, outputDir, timings, datasetTimings)
+
+		if resolver.unresolved:
+			PrintUnresolved(resolver.unresolved)
 
-	SaveConfigs(DataList, outputDir)
\ No newline at end of file
+		return outputDir
+	finally:
+		timings.stop()
\ No newline at end of file
@@ -0,0 +1,81 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Import time benchmark for the entry points of the program. Every module is imported in a fresh interpreter with
+# python -X importtime, the way a user starting the program would. Fails (exit code 1) when an entry point imports a
+# module it should only load on first use, or when its import takes longer than its budget.
+#
+#   python benchmarks/importtime.py
+#   python benchmarks/importtime.py --repeat 5 --top 15 TPM analysis
+#
+# Budgets are in milliseconds of cumulative import time, measured on a warm file cache. Slow or network-mounted
+# installs can scale them with --scale.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module: (budget in ms, modules that must not be imported)
+ENTRYPOINTS = {
+	"TPM": (600, ["matplotlib", "scipy", "pandas", "numba", "analysis", "plots", "generateplots"]),
+	"cli": (100, ["PyQt5", "matplotlib", "scipy", "numpy"]),
+	"analysis": (1000, ["PyQt5", "matplotlib", "scipy.optimize", "scipy.signal", "scipy.stats", "numba", "plots"]),
+	"export": (400, ["PyQt5", "matplotlib", "scipy", "pandas"]),
+	"plots": (1500, ["PyQt5", "scipy.stats"]),
+	"generateplots": (1500, ["PyQt5", "scipy.stats"]),
+}
+
+
+# Imports module in a new interpreter. Returns the modules -X importtime reported as
+# {name: (self time in us, cumulative time in us)} in import order.
+def importTime(module):
+	env = dict(os.environ, QT_QPA_PLATFORM = "offscreen")
+	process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd = ROOT, env = env,
+		stderr = subprocess.PIPE, stdout = subprocess.DEVNULL, universal_newlines = True)
+	if process.returncode != 0:
+		raise RuntimeError("Importing " + module + " failed:\n" + process.stderr)
+
+	times = {}
+	for line in process.stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		selfTime, cumulative, name = line[len("import time:"):].split("|")
+		times[name.strip()] = (int(selfTime), int(cumulative))
+	return times
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Checks the import time of the program's entry points.")
+	parser.add_argument("modules", nargs = "*", default = list(ENTRYPOINTS), help = "entry points to check (default: all)")
+	parser.add_argument("--repeat", type = int, default = 3, help = "imports per entry point, the fastest counts")
+	parser.add_argument("--top", type = int, default = 10, help = "number of slowest imports to list")
+	parser.add_argument("--scale", type = float, default = 1.0, help = "multiplies all budgets")
+	args = parser.parse_args()
+
+	failed = False
+	for module in args.modules:
+		budget, forbidden = ENTRYPOINTS[module]
+		budget = budget * args.scale
+
+		runs = [importTime(module) for _ in range(args.repeat)]
+		times = min(runs, key = lambda t: t[module][1])
+		total = times[module][1] / 1000
+
+		print(module + ": " + format(total, ".0f") + " ms (budget " + format(budget, ".0f") + " ms), " + str(len(times)) + " modules")
+		for name, (selfTime, cumulative) in sorted(times.items(), key = lambda t: -t[1][1])[1:args.top + 1]:
+			print("\t" + format(cumulative / 1000, "8.1f") + " ms  " + name.strip())
+
+		# -X importtime indents submodules by nesting depth, the names are stripped so this matches at any depth
+		imported = [name for name in forbidden if name in times]
+		if imported:
+			failed = True
+			print("\tFAIL: imports " + ", ".join(imported))
+		if total > budget:
+			failed = True
+			print("\tFAIL: over budget")
+
+	sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Compares the NumPy and the Numba-compiled (adaptivekde/jit.py) versions of the adaptivekde kernels: ssvkernel on the
+# default 1000 point grid, and the gaussian mean shift. Every backend runs in its own interpreter, selected with the
+# ADAPTIVEKDE_NUMBA environment variable. The compiled kernels are compiled (or loaded from the Numba cache) before timing.
+#
+#   python benchmarks/kernels.py
+#   python benchmarks/kernels.py --points 10000 1000000 --repeat 5
+#
+# Numba runs the kernels on all cores (prange); NUMBA_NUM_THREADS limits the number of threads.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The mean shift is O(points x starts) per iteration, it runs on a tenth of the points
+MEANSHIFTFRACTION = 10
+MEANSHIFTSTARTS = 20
+
+
+# Times the kernels on one dataset size with the backend the environment selects. Prints one line per kernel.
+def run(points, repeat):
+	sys.path.insert(0, ROOT)
+	import numpy as np
+	from adaptivekde import jit, mean
+	from adaptivekde.ssvkernel import ssvkernel
+
+	# Bimodal RMS values, like a TPM measurement of two populations
+	rng = np.random.default_rng(0)
+	x = np.concatenate([rng.normal(100, 8, points * 2 // 3), rng.normal(140, 5, points - points * 2 // 3)])
+	tin = np.linspace(50, 170, 1000)
+	xMeanShift = x[:points // MEANSHIFTFRACTION]
+	starts = np.linspace(60, 160, MEANSHIFTSTARTS)
+	h = np.std(xMeanShift) * np.power(4 / 3 / len(xMeanShift), 1 / 5)
+
+	kernels = {
+		"ssvkernel": lambda: ssvkernel(x, tin = tin, nbs = 0),
+		"mean_shift": lambda: mean.mean_shift(xMeanShift, starts.copy(), mean.Ks, h, 1e-6),
+	}
+	backend = "numba" if jit.kernels() != None else "numpy"
+	for name, kernel in kernels.items():
+		kernel()
+		times = []
+		for i in range(repeat):
+			start = time.perf_counter()
+			kernel()
+			times.append(time.perf_counter() - start)
+		print(backend + " " + name + " " + str(points) + " " + str(min(times)), flush = True)
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Compares the NumPy and Numba versions of the adaptivekde kernels.")
+	parser.add_argument("--points", type = int, nargs = "+", default = [10**4, 10**5, 10**6], help = "dataset sizes")
+	parser.add_argument("--repeat", type = int, default = 3, help = "runs per kernel, the fastest counts")
+	parser.add_argument("--run", action = "store_true", help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.run:
+		for points in args.points:
+			run(points, args.repeat)
+		return
+
+	results = {}
+	for backend in ["0", "1"]:
+		env = dict(os.environ, ADAPTIVEKDE_NUMBA = backend)
+		process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", "--repeat", str(args.repeat), "--points"] +
+			[str(points) for points in args.points], env = env, stdout = subprocess.PIPE, universal_newlines = True)
+		if process.returncode != 0:
+			sys.exit(process.returncode)
+		for line in process.stdout.splitlines():
+			name, kernel, points, seconds = line.split()
+			results[(name, kernel, int(points))] = float(seconds)
+
+	if not any(name == "numba" for name, _, _ in results):
+		print("Numba is not installed, only the NumPy kernels were timed")
+	print(format("kernel", "12") + format("points", ">10") + format("numpy", ">12") + format("numba", ">12") + format("speedup", ">10"))
+	for kernel in ["ssvkernel", "mean_shift"]:
+		for points in args.points:
+			numpyTime, numbaTime = results.get(("numpy", kernel, points)), results.get(("numba", kernel, points))
+			line = format(kernel, "12") + format(points, "10d") + format(numpyTime, "10.3f") + " s"
+			if numbaTime != None:
+				line = line + format(numbaTime, "10.3f") + " s" + format(numpyTime / numbaTime, "9.2f") + "x"
+			print(line)
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
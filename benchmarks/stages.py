@@ -0,0 +1,212 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+# Times every stage of the pipeline separately: reading the data, the KDEs, binning, fitting, saving the export, the 2D
+# histogram and every figure. Runs on a data folder, or on a synthetic one written by synthetic.py. The timings can be
+# written to a json file and compared with the json file of another commit.
+#
+#   python benchmarks/stages.py --datasets 100 --points 10000 --json before.json
+#   python benchmarks/stages.py --datasets 100 --points 10000 --compare before.json
+#   python benchmarks/stages.py "data/Example Data" --repeat 5 --stages FileLoader generateKDE[ssv]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import config as c
+import analysis
+import synthetic
+from dataclass import Data
+
+# Analysis and plot settings the stages run with, the defaults of the GUI
+CONFIG = {
+	"FileParam": {"RootDir": None, "Blacklist": None, "BlacklistConc": None},
+	"DataParam": {"MinRMS": 50.0, "MaxRMS": 170.0, "Bin": "ss", "KDE": "ss"},
+	"FittingParam": {"p0a": 30.0, "p0b": None, "p0c": 6.0, "ModeDetection": False, "ModeDetectionHeight": 0.01,
+		"ModeDetectionProminence": 0.01, "ModeDetectionDistance": 20.0},
+}
+FIGURE = {"Generate": True, "XDim": 10, "YDim": 7, "LabelFontSize": 30, "TickFontSize": 15, "OutputType": "png", "DPI": 100}
+PLOTCONFIG = {
+	"General": {"LaTeX": False, "Workers": 1},
+	"Histogram": dict(FIGURE, ColorHistogram = "tab:blue", ColorFit = "red", ColorKDE = "orange", AlphaHistogram = 0.7, ScaleLine = 1),
+	"Histogram2D": dict(FIGURE, Error = True, Bin = "ss", Normalisation = "area", ColorUnimodalScatter = "red",
+		ColorBimodalScatter = "orange", ColorError = "black", ScaleScatter = 1.5, ScaleError = 0.5),
+	"Violinplot": dict(FIGURE, Normalisation = True, Error = True, ColorUnimodalScatter = "red", ColorBimodalScatter = "orange",
+		ColorError = "black", ColorViolin = "#3397b5", ScaleScatter = 0.5, ScaleError = 0.1),
+	"Simpleplot": dict(FIGURE, ColorScatter = "red", ColorError = "Black", ScaleScatter = 5, ScaleError = 0.5),
+	"ECDF": dict(FIGURE, ColorScatter = "Black", ColorFit = "Black", AlphaFit = 0.3, ScaleLine = 0.5, ScaleScatter = 10),
+}
+
+KDEMETHODS = ["ss", "ssv", "scott"]
+STAGES = ["FileLoader"] + ["generateKDE[" + KDE + "]" for KDE in KDEMETHODS] + ["generateBinEdges", "fitData", "FitDatasets",
+	"SaveConfigs", "Histogram2D", "plot[Histogram2D]", "plot[Violinplot]", "plot[Simpleplot]", "plot[Histogram]", "plot[ECDF]"]
+
+
+# Runs function repeat times and stores the wall times in results[name]. warmup runs first without being timed, so
+# modules the stage imports on first use don't count. A stage that raises is reported and stored as an error so the
+# remaining stages still run.
+def timeStage(results, name, function, repeat, warmup=None):
+	times = []
+	for i in range(repeat + (warmup != None)):
+		start = time.perf_counter()
+		try:
+			if i == 0 and warmup != None:
+				warmup()
+				continue
+			function()
+		except Exception as e:
+			results[name] = {"error": type(e).__name__ + ": " + str(e)}
+			print(format(name, "20") + "  failed: " + results[name]["error"])
+			return
+		times.append(time.perf_counter() - start)
+	results[name] = {"times": times}
+	print(format(name, "20") + format(min(times), "10.3f") + " s" + format(sorted(times)[len(times) // 2], "10.3f") + " s")
+
+
+def runStages(rootDir, outputDir, stages, repeat, figures):
+	import plots
+	import generateplots
+
+	config = dict(CONFIG, FileParam = dict(CONFIG["FileParam"], RootDir = rootDir))
+	c.Config(config)
+	c.PlotConfig(PLOTCONFIG)
+	results = {}
+	print(format("stage", "20") + format("best", ">12") + format("median", ">12"))
+
+	# FileLoader prints every concentration it finds, keep the table readable
+	def fileLoader():
+		with contextlib.redirect_stdout(io.StringIO()):
+			return analysis.FileLoader(rootDir, None, None)
+
+	rawData, concentrations, paths, columns = fileLoader()
+	if "FileLoader" in stages:
+		timeStage(results, "FileLoader", fileLoader, repeat)
+
+	dataList = [Data(paths[i], rawData[i], concentrations[i], c.Config.get("DataParam.MinRMS"), c.Config.get("DataParam.MaxRMS"),
+		columns[i]) for i in range(len(rawData))]
+
+	def analyseAll(method, *args, datasets=None):
+		for d in dataList[:datasets]:
+			getattr(d, method)(*args)
+
+	# The KDE in the config runs last, so the later stages use it
+	for KDE in sorted(KDEMETHODS, key = lambda KDE: KDE == c.Config.get("DataParam.KDE")):
+		if "generateKDE[" + KDE + "]" in stages:
+			timeStage(results, "generateKDE[" + KDE + "]", lambda: analyseAll("generateKDE", KDE), repeat,
+				lambda: analyseAll("generateKDE", KDE, datasets = 1))
+	if not any(stage.startswith("generateKDE") for stage in stages):
+		analyseAll("generateKDE", c.Config.get("DataParam.KDE"))
+
+	for stage in ["generateBinEdges", "fitData"]:
+		if stage in stages:
+			timeStage(results, stage, lambda: analyseAll(stage), repeat, lambda: analyseAll(stage, datasets = 1))
+		else:
+			analyseAll(stage)
+
+	# fitData with the batch fit engine
+	if "FitDatasets" in stages:
+		timeStage(results, "FitDatasets", lambda: analysis.FitDatasets(dataList), repeat, lambda: analysis.FitDatasets(dataList[:1]))
+
+	def saveConfigs():
+		c.ExportConfig()
+		analysis.SaveConfigs(dataList, outputDir)
+
+	if "SaveConfigs" in stages:
+		timeStage(results, "SaveConfigs", saveConfigs, repeat)
+
+	plots.setFont()
+	if "Histogram2D" in stages:
+		timeStage(results, "Histogram2D", lambda: plots.Histogram2D(dataList), repeat)
+
+	def summaryFigure(plotType):
+		if plotType == "Histogram2D":
+			plots.Histogram2DPlot(plots.Histogram2D(dataList))
+		elif plotType == "Violinplot":
+			plots.ViolinPlot(dataList)
+		elif plotType == "Simpleplot":
+			plots.SimplePlot(dataList)
+		generateplots.saveFigure(outputDir + "/" + plotType.lower(), c.PlotConfig.get(plotType + ".OutputType"), c.PlotConfig.get(plotType + ".DPI"))
+
+	# Per-dataset figures are timed on the first datasets only, the time per figure scales linearly
+	def datasetFigures(plotType, datasets=figures):
+		for d in dataList[:datasets]:
+			os.makedirs(outputDir + "/" + d.path[1], exist_ok = True)
+			generateplots.saveDatasetFigure(plotType, d, outputDir)
+
+	for plotType in ["Histogram2D", "Violinplot", "Simpleplot"]:
+		if "plot[" + plotType + "]" in stages:
+			timeStage(results, "plot[" + plotType + "]", lambda: summaryFigure(plotType), repeat, lambda: datasetFigures("Histogram", 1))
+	for plotType in ["Histogram", "ECDF"]:
+		if "plot[" + plotType + "]" in stages:
+			timeStage(results, "plot[" + plotType + "]", lambda: datasetFigures(plotType), repeat, lambda: datasetFigures(plotType, 1))
+
+	return results, len(dataList), sum(len(d.data) for d in dataList)
+
+
+# Prints the best time of every stage next to the best time in an earlier results file
+def compare(results, previousFile):
+	with open(previousFile) as file:
+		previous = json.load(file)
+	print()
+	print("compared with " + previousFile + " (" + str(previous.get("commit")) + ")")
+	print(format("stage", "20") + format("before", ">12") + format("now", ">12") + format("speedup", ">10"))
+	for stage in STAGES:
+		before = previous["stages"].get(stage, {}).get("times")
+		now = results.get(stage, {}).get("times")
+		if before and now:
+			print(format(stage, "20") + format(min(before), "10.3f") + " s" + format(min(now), "10.3f") + " s" + format(min(before) / min(now), "9.2f") + "x")
+
+
+def commit():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = ROOT, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL,
+			universal_newlines = True).stdout.strip() or None
+	except OSError:
+		return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Times every stage of the analysis and plotting pipeline.")
+	parser.add_argument("rootDir", nargs = "?", help = "data folder to benchmark (default: a synthetic folder, see --datasets)")
+	parser.add_argument("--datasets", type = int, default = 12, help = "synthetic datasets (default: 12)")
+	parser.add_argument("--points", type = int, default = 1000, help = "RMS values per synthetic dataset (default: 1000)")
+	parser.add_argument("--bimodal", type = float, default = 0.5, help = "fraction of bimodal synthetic datasets (default: 0.5)")
+	parser.add_argument("--seed", type = int, default = 0)
+	parser.add_argument("--stages", nargs = "+", default = STAGES, choices = STAGES, metavar = "STAGE", help = "stages to time (default: all): " + ", ".join(STAGES))
+	parser.add_argument("--repeat", type = int, default = 3, help = "runs per stage (default: 3)")
+	parser.add_argument("--figures", type = int, default = 10, help = "datasets to time the histogram and ECDF figures on (default: 10)")
+	parser.add_argument("--json", help = "write the timings to this file")
+	parser.add_argument("--compare", help = "json file of an earlier run to compare with")
+	args = parser.parse_args()
+
+	workDir = tempfile.mkdtemp(prefix = "tpm-benchmark-")
+	try:
+		rootDir = args.rootDir
+		if rootDir == None:
+			rootDir = os.path.join(workDir, "Synthetic")
+			synthetic.generate(rootDir, args.datasets, args.points, args.bimodal, seed = args.seed)
+		outputDir = os.path.join(workDir, "output")
+		os.makedirs(outputDir)
+
+		results, datasets, points = runStages(rootDir, outputDir, args.stages, args.repeat, args.figures)
+	finally:
+		shutil.rmtree(workDir, ignore_errors = True)
+
+	if args.json:
+		with open(args.json, "w") as file:
+			json.dump({"commit": commit(), "date": time.strftime("%Y-%m-%d %H:%M:%S"), "rootDir": args.rootDir, "datasets": datasets,
+				"points": points, "repeat": args.repeat, "figures": args.figures, "stages": results}, file, indent = 1)
+	if args.compare:
+		compare(results, args.compare)
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+import argparse
+import numpy as np
+
+# Writes a synthetic data folder for benchmarks: <root>/<day>/<n> nM .../data_good.txt, like the Example Data folder.
+# Every data_good.txt has the five whitespace separated columns of a real one: RMS, anisotropy ratio, its spread, series
+# number and bead number. RMS values are drawn from one or two populations (unbound DNA around 145 nm, compacted DNA
+# around 100 nm) weighted by a binding curve of the concentration, plus some outliers outside the usual RMS limits.
+#
+#   python benchmarks/synthetic.py "data/Synthetic" --datasets 100 --points 10000
+#   python benchmarks/synthetic.py "data/Synthetic" --datasets 10000 --points 100 --bimodal 0.5
+
+CONCENTRATIONS = [0, 25, 50, 75, 100, 125, 200, 300, 400, 600, 900, 1200]
+
+# RMS populations (mean, standard deviation) in nm
+UNBOUND = (145.0, 8.0)
+BOUND = (100.0, 7.0)
+# Concentration in nM at which half of the tethers are compacted
+KD = 200.0
+OUTLIERS = 0.03
+
+# Rows are written in blocks so 10^7 points per dataset don't need all the formatted text in memory at once
+BLOCKSIZE = 1000000
+
+
+# Returns the RMS values of one dataset. Bimodal datasets are a mixture of the two populations, unimodal datasets a
+# single population in between them.
+def rmsValues(rng, points, concentration, bimodal):
+	bound = concentration / (concentration + KD)
+	if bimodal:
+		isBound = rng.random(points) < bound
+		rms = np.where(isBound, rng.normal(BOUND[0], BOUND[1], points), rng.normal(UNBOUND[0], UNBOUND[1], points))
+	else:
+		rms = rng.normal(UNBOUND[0] + bound * (BOUND[0] - UNBOUND[0]), UNBOUND[1], points)
+
+	outliers = rng.random(points) < OUTLIERS
+	rms[outliers] = rng.uniform(20, 500, np.count_nonzero(outliers))
+	return rms
+
+# Writes one data_good.txt in the five-column format
+def writeDataGood(fileName, rng, points, concentration, bimodal):
+	rms = rmsValues(rng, points, concentration, bimodal)
+	with open(fileName, "w") as file:
+		for start in range(0, points, BLOCKSIZE):
+			n = min(BLOCKSIZE, points - start)
+			ratio = rng.normal(1.11, 0.065, n)
+			ratioSpread = np.abs(rng.normal(0.05, 0.006, n))
+			# Series of 300 beads. Bead numbers increase within a series, with gaps for rejected beads.
+			index = start + np.arange(n)
+			series = 1 + index // 300
+			bead = 1 + 2 * (index % 300) + rng.integers(0, 2, n)
+			block = np.column_stack([rms[start:start + n], ratio, ratioSpread, series, bead])
+			np.savetxt(file, block, fmt = "%16.7e", delimiter = "")
+
+# Creates the folder tree. Datasets are spread over the days and cycle through CONCENTRATIONS; repeated concentrations
+# on the same day get a numbered folder, like "125 nM HB T50K75 2".
+def generate(rootDir, datasets = 12, points = 1000, bimodal = 0.5, days = 2, seed = 0):
+	rng = np.random.default_rng(seed)
+	for i in range(datasets):
+		day = "2101%02d_Synthetic" % (1 + i % days)
+		concentration = CONCENTRATIONS[(i // days) % len(CONCENTRATIONS)]
+		repeat = i // (days * len(CONCENTRATIONS))
+		folderName = str(concentration) + " nM HB T50K75" + (" " + str(repeat + 1) if repeat else "")
+
+		folder = os.path.join(rootDir, day, folderName)
+		os.makedirs(folder, exist_ok = True)
+		writeDataGood(os.path.join(folder, "data_good.txt"), rng, points, concentration, rng.random() < bimodal)
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Writes a synthetic TPM data folder.")
+	parser.add_argument("rootDir", help = "folder to create the data in")
+	parser.add_argument("--datasets", type = int, default = 12, help = "number of data_good.txt files (default: 12)")
+	parser.add_argument("--points", type = int, default = 1000, help = "RMS values per dataset (default: 1000)")
+	parser.add_argument("--bimodal", type = float, default = 0.5, help = "fraction of bimodal datasets (default: 0.5)")
+	parser.add_argument("--days", type = int, default = 2, help = "number of day folders (default: 2)")
+	parser.add_argument("--seed", type = int, default = 0)
+	args = parser.parse_args()
+
+	generate(args.rootDir, args.datasets, args.points, args.bimodal, args.days, args.seed)
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
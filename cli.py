@@ -0,0 +1,96 @@
+import os
+import argparse
+import timings
+
+# Headless command line entry point for batch jobs. It runs the analysis and saves the plots without the GUI, so PyQt5 is
+# never imported and no display is needed.
+#
+#   python cli.py analyze config.yaml
+#   python cli.py plot config_export.yaml config_plot.yaml
+#
+# config.yaml and config_plot.yaml have the same layout as the config.yaml that is saved with every analysis and the
+# config_plot.yaml the Plot tab writes.
+
+# Never pick an interactive matplotlib backend on compute nodes
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+
+# Progress reporter that prints the percentages emitted by the analysis and by generateplots
+class ConsoleProgress():
+	def __init__(self, label):
+		self.label = label
+		self.last = None
+
+	def emit(self, i):
+		if i != self.last:
+			self.last = i
+			print("\r" + self.label + ": " + str(i) + "%", end = "\n" if i >= 100 else "", flush = True)
+
+
+def analyze(args):
+	import analysis
+	import config as c
+
+	c.Config(args.config)
+	if args.workers != None:
+		c.Config.config.setdefault("DataParam", {})["Workers"] = args.workers
+
+	outputDir = analysis.DataAnalysis(c.Config.config, ConsoleProgress("Analysis"))
+	if outputDir == None:
+		raise SystemExit(1)
+	print("Saved analysis in " + outputDir)
+
+	# DataParam.Timings
+	if "Timings" in c.ExportConfig.config:
+		print("Timings:\n" + timings.FormatStages(c.ExportConfig.config["Timings"]["Stages"]))
+		print("Timings of all datasets:\n" + timings.FormatStages(c.ExportConfig.config["Timings"]["DatasetTotals"]))
+
+
+def plot(args):
+	import export
+	import generateplots
+	import config as c
+
+	configExport, dataList = export.LoadExport(args.exportConfig)
+	c.Config(configExport["Config"])
+	c.PlotConfig(args.plotConfig)
+	if args.workers != None:
+		c.PlotConfig.config.setdefault("General", {})["Workers"] = args.workers
+
+	outputDir = args.output or os.path.dirname(os.path.abspath(args.exportConfig))
+	if not os.path.exists(outputDir):
+		os.makedirs(outputDir)
+
+	try:
+		stages = generateplots.generateplots(dataList, outputDir, ConsoleProgress("Plots"))
+	finally:
+		export.CloseExport(dataList)
+	print("Saved plots in " + outputDir)
+
+	# General.Timings
+	if stages:
+		print("Timings:\n" + timings.FormatStages(stages))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description = "TPM data analysis without the GUI.")
+	subparsers = parser.add_subparsers(dest = "command", required = True)
+
+	analyzeParser = subparsers.add_parser("analyze", help = "analyse the data_good.txt files described by a config file")
+	analyzeParser.add_argument("config", help = "config.yaml with FileParam, DataParam and FittingParam")
+	analyzeParser.add_argument("--workers", type = int, help = "overrides DataParam.Workers")
+	analyzeParser.set_defaults(function = analyze)
+
+	plotParser = subparsers.add_parser("plot", help = "save the plots of an analysed export")
+	plotParser.add_argument("exportConfig", help = "config_export.yaml written by the analysis")
+	plotParser.add_argument("plotConfig", help = "config_plot.yaml with the plot options")
+	plotParser.add_argument("--output", help = "folder to save the plots in (default: the folder of the export)")
+	plotParser.add_argument("--workers", type = int, help = "overrides General.Workers")
+	plotParser.set_defaults(function = plot)
+
+	args = parser.parse_args(argv)
+	args.function(args)
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import re
+import yaml
+
+# Resolves the concentration (in nM) of a data folder without ever asking the user. In order of precedence:
+#   1. a mapping file (FileParam.ConcentrationMap): a yaml file of {folder: concentration}, where folder is the path of the
+#      data folder relative to the root folder ("210204_Samuel/75 nM HB T50K75") or just its name ("75 nM HB T50K75"),
+#   2. a sidecar file in the data folder (FileParam.ConcentrationFile, default concentration.txt) holding the concentration,
+#   3. the name of the data folder, matched against FileParam.ConcentrationPatterns: a list of [regex, scale] pairs, tried in
+#      order. The first group of the regex is the number, scale converts it to nM.
+# A concentration is a number in nM, or a number followed by one of the UNITS ("0.5 mM"). Folders that can't be resolved
+# are collected in unresolved, so the run can report them at the end.
+
+UNITS = {"pM": 1e-3, "nM": 1.0, "uM": 1e3, "µM": 1e3, "mM": 1e6, "M": 1e9}
+UNITSLOWERCASE = {unit.lower(): scale for unit, scale in UNITS.items()}
+
+PATTERNS = [[r"(\d+[.,]?\d*)(?:[\s_-]*)(?:nM)", 1.0], [r"(\d+[.,]?\d*)(?:[\s_-]*)(?:mM)", 1e6]]
+
+VALUE = re.compile(r"^\s*(\d+[.,]?\d*(?:e[+-]?\d+)?)\s*(" + "|".join(UNITS) + r")?\s*$", flags = re.I)
+
+
+# Parses "75", "75 nM" or "0,5mM" into nM. Returns None if value is not a concentration.
+def ParseConcentration(value):
+	if isinstance(value, (int, float)) and not isinstance(value, bool):
+		return float(value)
+	match = VALUE.match(str(value))
+	if not match:
+		return None
+	unit = match.group(2) or "nM"
+	return float(match.group(1).replace(",", ".")) * UNITS.get(unit, UNITSLOWERCASE[unit.lower()])
+
+
+class ConcentrationResolver():
+
+	def __init__(self, rootDir, mapping=None, sidecar="concentration.txt", patterns=None):
+		self.rootDir = rootDir
+		self.sidecar = sidecar
+		self.unresolved = []
+
+		# The mapping can be a yaml file or, from a config, the mapping itself
+		self.mapping = {}
+		if isinstance(mapping, str) and mapping != "":
+			with open(mapping) as file:
+				mapping = yaml.safe_load(file)
+		if isinstance(mapping, dict):
+			self.mapping = {os.path.normpath(str(folder)): value for folder, value in mapping.items()}
+
+		self.patterns = [(re.compile(pattern, flags = re.I), float(scale)) for pattern, scale in (patterns or PATTERNS)]
+
+	# Returns the concentration of the data folder subdir in nM and where it was found, or None, None (and adds subdir to
+	# unresolved) if it couldn't be resolved
+	def resolve(self, subdir):
+		name = os.path.basename(os.path.normpath(subdir))
+
+		relativePath = os.path.normpath(os.path.relpath(subdir, self.rootDir))
+		for folder in [relativePath, name]:
+			if folder in self.mapping:
+				concentration = ParseConcentration(self.mapping[folder])
+				if concentration != None:
+					return concentration, "concentration file"
+
+		if self.sidecar:
+			try:
+				with open(os.path.join(subdir, self.sidecar)) as file:
+					concentration = ParseConcentration(file.read())
+				if concentration != None:
+					return concentration, self.sidecar
+			except OSError:
+				pass
+
+		for pattern, scale in self.patterns:
+			match = pattern.search(name)
+			if match:
+				return float(match.group(1).replace(",", ".")) * scale, "folder name"
+
+		self.unresolved.append(subdir)
+		return None, None
\ No newline at end of file
@@ -1,11 +1,12 @@
-from scipy.optimize import curve_fit
-from scipy.signal import find_peaks
 from typing import List
 from adaptivekde.sshist import sshist
 from adaptivekde.sskernel import sskernel
 from adaptivekde.ssvkernel import ssvkernel
+from adaptivekde.binnedkernel import binnedkernel
+from adaptivekde.mean import binned_mean_shift
 from dataclasses import dataclass, field, asdict
 
+import warnings
 import numpy as np
 import config as c
 import fit
@@ -19,9 +20,11 @@ class Data:
 	concentration: float
 	minRMS: float
 	maxRMS: float
+	extraColumns: dict = field(default_factory=dict)
 
 	xKDE: List[float] = field(default_factory=list)
 	yKDE: List[float] = field(default_factory=list)
+	confb95: List[float] = field(default_factory=list)
 
 	binEdges: List[float] = field(default_factory=list)
 
@@ -30,21 +33,55 @@ class Data:
 	mode: str = "placeholder"
 
 
+	# The filtered data and the histogram used for fitting are calculated once and cached on the instance.
+	# Assigning new raw data, RMS limits or bin edges drops the cached arrays that depend on them.
+	def __setattr__(self, name, value):
+		if name in ("data", "minRMS", "maxRMS"):
+			self.__dict__.pop("_dataFiltered", None)
+			self.__dict__.pop("_histogram", None)
+		elif name == "binEdges":
+			self.__dict__.pop("_histogram", None)
+		object.__setattr__(self, name, value)
+
+	# Cached arrays are not pickled (e.g. when sending instances to or from worker processes), they are recalculated when needed
+	def __getstate__(self):
+		return {key: value for key, value in self.__dict__.items() if not key.startswith("_")}
+
 	def filterData(self):
-		return self.data[np.where(np.logical_and(self.data>=self.minRMS, self.data<=self.maxRMS))]		
+		if "_dataFiltered" not in self.__dict__:
+			data = np.asarray(self.data)
+			dataFiltered = data[(data >= self.minRMS) & (data <= self.maxRMS)]
+			# Read-only, since every caller gets the same array
+			dataFiltered.flags.writeable = False
+			self.__dict__["_dataFiltered"] = dataFiltered
+		return self.__dict__["_dataFiltered"]
+
+	# Returns the counts of the filtered data in self.binEdges and the centers of those bins
+	def histogram(self):
+		if "_histogram" not in self.__dict__:
+			binEdges = np.asarray(self.binEdges)
+			counts, _ = np.histogram(self.filterData(), bins=binEdges)
+			self.__dict__["_histogram"] = (counts, (binEdges[:-1] + binEdges[1:]) / 2)
+		return self.__dict__["_histogram"]
 
 	def generateKDE(self, KDE):
 		dataFiltered = self.filterData()
 		tin = np.linspace(self.minRMS, self.maxRMS, int(1e3))
 
+		# The bootstrapped 5%/95% confidence bands of the KDE are only calculated when the user asks for them (DataParam.KDEBootstrap > 0)
+		nbs = c.Config.get("DataParam.KDEBootstrap", 0)
+
 		if KDE == "ssv":
-			self.yKDE, self.xKDE, _, _, _, _, _ = ssvkernel(dataFiltered, tin = tin)
+			self.yKDE, self.xKDE, _, _, _, confb95, _ = ssvkernel(dataFiltered, tin = tin, nbs = nbs)
+			if nbs:
+				self.confb95 = confb95
 		elif KDE == "ss":
-			self.yKDE, self.xKDE, _, _, _, _, _ = sskernel(dataFiltered, tin = tin)
+			self.yKDE, self.xKDE, _, _, _, confb95, _ = sskernel(dataFiltered, tin = tin, nbs = nbs)
+			if nbs:
+				self.confb95 = confb95
+		# Otherwise KDE is a bandwidth rule of scipy.stats.gaussian_kde ("scott", "silverman") or a bandwidth factor
 		else:
-			kde = gaussian_kde(dataFiltered, bw_method = KDE)
-			self.yKDE = kde.evaluate(points = tin)
-			self.xKDE = tin
+			self.yKDE, self.xKDE, _ = binnedkernel(dataFiltered, tin = tin, bw_method = KDE)
 
 	def generateBinEdges(self):
 		def bin(method):
@@ -65,83 +102,98 @@ class Data:
 		dataFiltered = self.filterData()
 		self.binEdges = bin(c.Config.get("DataParam.Bin"))
 
-	def fitData(self):
-
-		def defaultUnimodalFitting():
-			max_value = np.amax(histogram)
-			max_index = np.where(histogram == max_value)[0]
-			p0b = binCenters[max_index]
-			popt, pcov = curve_fit(fit.unimodal,binCenters,histogram, p0=[c.Config.get("FittingParam.p0a"),p0b[0],c.Config.get("FittingParam.p0c")])
-			return popt, pcov
-
-		def calculateVar(pcov):
-			return np.diag(pcov)
-
-		dataFiltered = self.filterData()
-		histogram, _ = np.histogram(dataFiltered, bins=self.binEdges)
-		binCenters = (self.binEdges[:-1] + self.binEdges[1:]) / 2
-
+	# Initial guess of a unimodal fit: the center of the most populated bin is the b parameter. Returns the mode and p0.
+	def defaultGuess(self):
+		histogram, binCenters = self.histogram()
+		max_value = np.amax(histogram)
+		max_index = np.where(histogram == max_value)[0]
+		p0b = binCenters[max_index]
+		return "unimodal", [c.Config.get("FittingParam.p0a"),p0b[0],c.Config.get("FittingParam.p0c")]
+
+	# Finds the modes of the data for the automatic modal detection. Returns at most two modes.
+	# FittingParam.ModeDetectionMethod chooses how:
+	#   kde (default): peaks of the KDE found by find_peaks with the minimum height, prominence and distance given by the user.
+	#   meanshift: a binned mean shift on the filtered data (adaptivekde/mean.py), which doesn't depend on the KDE. Modes that hold
+	#   less than FittingParam.ModeDetectionWeight (default 0.05) of the data are ignored, and of two modes closer than
+	#   FittingParam.ModeDetectionDistance only the heaviest is kept.
+	def findModes(self):
+		if c.Config.get("FittingParam.ModeDetectionMethod", "kde") == "meanshift":
+			modes, weights = binned_mean_shift(self.filterData())
+			peaks = []
+			for index in np.argsort(weights)[::-1]:
+				if weights[index] < c.Config.get("FittingParam.ModeDetectionWeight", 0.05) and peaks:
+					break
+				if all(abs(modes[index] - peak) >= c.Config.get("FittingParam.ModeDetectionDistance") for peak in peaks):
+					peaks.append(modes[index])
+			return np.asarray(peaks[:2])
+
+		from scipy.signal import find_peaks
+
+		# The minimum distance given by the user is the distance between two peaks in RMS value. 
+		# self.yKDE is a 1D array with 1000 entries but spans over the self.maxRMS self.minRMS distance.
+		# So we need to convert the RMS distance the user has given into the distance in the 1D self.yKDE array.
+		distance = c.Config.get("FittingParam.ModeDetectionDistance") / (self.maxRMS - self.minRMS) * len(self.yKDE)
+		foundPeaks, _ = find_peaks(self.yKDE, height = c.Config.get("FittingParam.ModeDetectionHeight"), 
+			prominence = c.Config.get("FittingParam.ModeDetectionProminence"), distance = distance)
+
+		# If more than 2 peaks are found, pick the two largest peaks (currently no fitting for trimodal)
+		if len(foundPeaks) > 2:
+			foundPeaks = foundPeaks[np.argsort(np.asarray(self.yKDE)[foundPeaks])[::-1]][:2]
+		return np.asarray(self.xKDE)[foundPeaks]
+
+	# Chooses the model to fit ("unimodal" or "bimodal") and its initial parameters p0. Returns None, None if there is
+	# nothing to fit. Used by fitData and by the batched fitting in analysis.FitDatasets.
+	def fitGuess(self):
 		# Check if user specified specific b parameters. If they did, check if the parameters are for this dataset
 		if type(c.Config.get("FittingParam.p0b")) == dict and (self.path[1] + "/" + self.path[2]) in c.Config.get("FittingParam.p0b"):
 			print("Placeholder")
+			return None, None
 
 		# If user has not specified specific b parameters, check if user wants automatic modal detection.
+		if c.Config.get("FittingParam.ModeDetection") == True:
+			p0b = self.findModes()
+
+			# Two peaks found, perform bimodal fitting
+			if len(p0b) == 2:
+				return "bimodal", [c.Config.get("FittingParam.p0a"),p0b[0],c.Config.get("FittingParam.p0c"),
+					c.Config.get("FittingParam.p0a"),p0b[1],c.Config.get("FittingParam.p0c")]
+
+			# One peak found, unimodal fitting
+			elif len(p0b) == 1:
+				return "unimodal", [c.Config.get("FittingParam.p0a"),p0b[0],c.Config.get("FittingParam.p0c")]
+
+		# If user doesn't want automatic modal detection (or no peak was found), find the most populated bin and set the center of that
+		# bin as our b parameter and perform unimodal fitting
+		return self.defaultGuess()
+
+	# Stores the result of a fit
+	def setFit(self, mode, pOpt, pcov):
+		self.pOpt = fit.PositiveWidths(pOpt)
+		self.pVar = np.diag(pcov)
+		self.mode = mode
+
+	def fitData(self):
+		# Imported here rather than at the top: loading an export or plotting never fits, and scipy.optimize is slow to import
+		from scipy.optimize import curve_fit, OptimizeWarning
+
+		mode, p0 = self.fitGuess()
+		if mode == None:
+			return
+
+		histogram, binCenters = self.histogram()
+		function = fit.MODELS[mode][0]
+
+		# With modal detection, a failing fit falls back on the default unimodal fit. A fit fails when it doesn't converge
+		# (RuntimeError) or when its covariance can't be estimated (OptimizeWarning, raised as an error here).
+		if c.Config.get("FittingParam.ModeDetection") == True:
+			try:
+				with warnings.catch_warnings():
+					warnings.simplefilter("error", OptimizeWarning)
+					pOpt, pcov = curve_fit(function,binCenters,histogram, p0=p0)
+			except (RuntimeError, OptimizeWarning):
+				mode, p0 = self.defaultGuess()
+				pOpt, pcov = curve_fit(fit.unimodal,binCenters,histogram, p0=p0)
 		else:
-			if c.Config.get("FittingParam.ModeDetection") == True:
-				# The KDE is used for modal detection. We find peaks based on the peak parameters (minimum height, prominence, and distance) specified by user.
-				
-				# The minimum distance given by the user is the distance between two peaks in RMS value. 
-				# self.yKDE is a 1D array with 1000 entries but spans over the self.maxRMS self.minRMS distance.
-				# So we need to convert the RMS distance the user has given into the distance in the 1D self.yKDE array.
-				distance = c.Config.get("FittingParam.ModeDetectionDistance") / (self.maxRMS - self.minRMS) * len(self.yKDE)
-				foundPeaks, _ = find_peaks(self.yKDE, height = c.Config.get("FittingParam.ModeDetectionHeight"), 
-					prominence = c.Config.get("FittingParam.ModeDetectionProminence"), distance = distance)
-				peaks = self.xKDE[foundPeaks]
-								
-				# If more than 2 peaks are found, pick the two largest peaks and perform bimodal fitting (currently no fitting for trimodal)
-				if len(peaks) > 2:
-					peakHeight = [yKDE[peak] for peak in peaks]
-					p0b = peaks[peakHeight.argsort()[::-1]]
-					p0b = p0b[:2]
-					try:
-						self.pOpt, pcov = curve_fit(fit.bimodal,binCenters,histogram, p0=[c.Config.get("FittingParam.p0a"),p0b[0],c.Config.get("FittingParam.p0c"),
-							c.Config.get("FittingParam.p0a"),p0b[1],c.Config.get("FittingParam.p0c")])
-						self.pVar = calculateVar(pcov)
-						self.mode = "bimodal"
-					except OptimizeWarning:
-						self.pOpt, pcov = defaultUnimodalFitting()
-						self.pVar = calculateVar(pcov)
-						self.mode = "unimodal"
-
-				# Two peaks found, perform bimodal fitting
-				elif len(peaks) == 2:
-					p0b = peaks
-					try:
-						self.pOpt, pcov = curve_fit(fit.bimodal,binCenters,histogram, p0=[c.Config.get("FittingParam.p0a"),p0b[0],c.Config.get("FittingParam.p0c"),
-							c.Config.get("FittingParam.p0a"),p0b[1],c.Config.get("FittingParam.p0c")])
-						self.pVar = calculateVar(pcov)
-						self.mode = "bimodal"
-					except OptimizeWarning:
-						self.pOpt, pcov = defaultUnimodalFitting()
-						self.pVar = calculateVar(pcov)
-						self.mode = "unimodal"
-
-				# One peak found, unimodal fitting
-				elif len(peaks) < 2:
-					p0b = peaks
-					try:
-						self.pOpt, pcov = curve_fit(fit.unimodal,binCenters,histogram, p0=[c.Config.get("FittingParam.p0a"),p0b[0],c.Config.get("FittingParam.p0c")])
-						self.pVar = calculateVar(pcov)
-						self.mode = "unimodal"
-					except OptimizeWarning:
-						self.pOpt, pcov = defaultUnimodalFitting()
-						self.pVar = calculateVar(pcov)
-						self.mode = "unimodal"
-
-
-			# If user doesn't want automatic modal detection, find the most populated bin and set the center of that bin as our b parameter
-			# and perform unimodal fitting
-			else:
-				self.pOpt, pcov = defaultUnimodalFitting()
-				self.pVar = calculateVar(pcov)
-				self.mode = "unimodal"
\ No newline at end of file
+			pOpt, pcov = curve_fit(function,binCenters,histogram, p0=p0)
+
+		self.setFit(mode, pOpt, pcov)
\ No newline at end of file
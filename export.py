@@ -0,0 +1,100 @@
+import yaml
+import numpy as np
+import os.path
+
+from collections.abc import Sequence
+from dataclasses import fields
+from dataclass import Data
+
+# Export format of the analysed data.
+# config_export.yaml holds the config and, for every dataset, its metadata (path, concentration, RMS limits and mode) together
+# with the names of its arrays. The arrays themselves (raw RMS values, KDE, bins, fit) are stored in config_export.npz next to it.
+# Older exports that have the complete data classes in the yaml file can still be loaded.
+
+ARRAYFILE = "config_export.npz"
+FORMATVERSION = 2
+
+# Fields of the data class that are stored in the yaml file. All other fields are arrays (or dictionaries of arrays) and go
+# into the npz file.
+METADATA = ("path", "concentration", "minRMS", "maxRMS", "mode")
+
+
+# Splits the data classes into the metadata that goes into the export config and a dictionary of arrays for the npz file
+def SplitData(dataList):
+	dataDict, arrays = {}, {}
+	for index, d in enumerate(dataList):
+		entry = {"arrays": {}}
+		for f in fields(Data):
+			value = getattr(d, f.name)
+			if f.name in METADATA:
+				# tolist() turns numpy scalars and arrays into plain python types for the yaml file
+				entry[f.name] = np.asarray(value).tolist()
+			elif isinstance(value, dict):
+				entry["arrays"][f.name] = {}
+				for name, array in value.items():
+					key = str(index) + "." + f.name + "." + name
+					arrays[key] = np.asarray(array)
+					entry["arrays"][f.name][name] = key
+			else:
+				key = str(index) + "." + f.name
+				arrays[key] = np.asarray(value)
+				entry["arrays"][f.name] = key
+		dataDict[d.path[1] + "/" + d.path[2]] = entry
+	return dataDict, arrays
+
+
+def SaveArrays(arrays, path):
+	# Uncompressed, so saving and loading is a plain copy of the array buffers
+	np.savez(path + "/" + ARRAYFILE, **arrays)
+
+
+# The data classes of an export, constructed when a dataset is first accessed. Only the arrays of the datasets that are
+# actually used are read from the npz file.
+class ExportData(Sequence):
+
+	def __init__(self, entries, arrays):
+		self.entries = list(entries.values())
+		self.arrays = arrays
+		self.loaded = {}
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(len(self))[index]]
+		index = range(len(self))[index]
+		if index not in self.loaded:
+			entry = self.entries[index]
+			kwargs = {name: entry[name] for name in METADATA}
+			for name, key in entry["arrays"].items():
+				if isinstance(key, dict):
+					kwargs[name] = {column: self.arrays[columnKey] for column, columnKey in key.items()}
+				else:
+					kwargs[name] = self.arrays[key]
+			self.loaded[index] = Data(**kwargs)
+		return self.loaded[index]
+
+	# Closes the npz file. Datasets that were already accessed keep their arrays, the others can't be loaded any more.
+	def close(self):
+		self.arrays.close()
+
+
+# Loads an export config. Returns the export config and the data classes of all datasets. Newer exports keep their npz
+# file open until CloseExport is called on the data classes.
+def LoadExport(path):
+	# The C loader is a lot faster for the older exports that have all data in the yaml file
+	with open(path) as file:
+		configExport = yaml.load(file, Loader = getattr(yaml, "CLoader", yaml.Loader))
+
+	if configExport.get("Format", {}).get("Version", 1) < FORMATVERSION:
+		dataList = [Data(**configExport["Data"][key]) for key in configExport["Data"]]
+	else:
+		dataList = ExportData(configExport["Data"], np.load(os.path.join(os.path.dirname(path), configExport["Format"]["Arrays"])))
+
+	return configExport, dataList
+
+# Closes the npz file of data classes returned by LoadExport. Older exports have no file to close.
+def CloseExport(dataList):
+	if isinstance(dataList, ExportData):
+		dataList.close()
@@ -0,0 +1,64 @@
+import os
+import yaml
+import hashlib
+import numpy as np
+
+# Sidecar cache of parsed data_good.txt files.
+# Every text file gets an entry in the cache folder: one .npy file per column and a small .yaml file with the key the
+# arrays were parsed under. The key holds the path, size and modification time of the text file, optionally a hash of its
+# content, and the columns that were read. An entry is only used when its key still matches, so only new or modified
+# files are parsed again. Cached arrays are loaded memory-mapped.
+
+
+# Name of the cache entry of a file, derived from its absolute path
+def entryName(path):
+	return hashlib.sha1(os.path.normcase(os.path.abspath(path)).encode("utf-8")).hexdigest()
+
+
+def contentHash(path):
+	sha1 = hashlib.sha1()
+	with open(path, "rb") as file:
+		for block in iter(lambda: file.read(1 << 20), b""):
+			sha1.update(block)
+	return sha1.hexdigest()
+
+
+def fileKey(path, columns, hashContent=False):
+	stat = os.stat(path)
+	key = {"Path": os.path.abspath(path), "Size": stat.st_size, "MTime": stat.st_mtime_ns, "Columns": dict(columns)}
+	if hashContent:
+		key["Hash"] = contentHash(path)
+	return key
+
+
+# Returns the cached RMS values and extra columns of a file, or None if the file is not cached or changed since
+def load(cacheDir, path, key):
+	entry = cacheDir + "/" + entryName(path)
+	try:
+		with open(entry + ".yaml") as file:
+			cachedKey = yaml.safe_load(file)
+		if cachedKey != key:
+			return None
+		# np.asarray drops the memmap subclass but keeps the memory-mapped buffer
+		rms = np.asarray(np.load(entry + "-data.npy", mmap_mode = "r"))
+		extraColumns = {}
+		for name in key["Columns"]:
+			extraColumns[name] = np.asarray(np.load(entry + "-" + name + ".npy", mmap_mode = "r"))
+	except (OSError, ValueError, yaml.YAMLError):
+		return None
+	return rms, extraColumns
+
+
+def store(cacheDir, path, key, rms, extraColumns):
+	if not os.path.exists(cacheDir):
+		os.makedirs(cacheDir)
+	entry = cacheDir + "/" + entryName(path)
+
+	# The key is written last, so an interrupted write never leaves an entry that looks valid
+	if os.path.exists(entry + ".yaml"):
+		os.remove(entry + ".yaml")
+	np.save(entry + "-data.npy", rms)
+	for name, column in extraColumns.items():
+		np.save(entry + "-" + name + ".npy", column)
+	with open(entry + ".yaml", "w") as file:
+		yaml.safe_dump(key, file)
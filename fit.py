@@ -4,4 +4,114 @@ def unimodal(x, a, b, c):
 	return a*np.exp((-0.5)*np.square(x-b)/np.square(c))
 
 def bimodal(x, a1, b1, c1, a2, b2, c2):
-	return a1*np.exp((-0.5)*np.square(x-b1)/np.square(c1)) + a2*np.exp((-0.5)*np.square(x-b2)/np.square(c2))
\ No newline at end of file
+	return a1*np.exp((-0.5)*np.square(x-b1)/np.square(c1)) + a2*np.exp((-0.5)*np.square(x-b2)/np.square(c2))
+
+# Jacobians of the models with respect to their parameters, shape (..., len(x), number of parameters)
+def unimodalJacobian(x, a, b, c):
+	e = np.exp((-0.5)*np.square(x-b)/np.square(c))
+	return np.stack([e, a*e*(x-b)/np.square(c), a*e*np.square(x-b)/c**3], axis=-1)
+
+def bimodalJacobian(x, a1, b1, c1, a2, b2, c2):
+	return np.concatenate([unimodalJacobian(x, a1, b1, c1), unimodalJacobian(x, a2, b2, c2)], axis=-1)
+
+# Model function, Jacobian and number of parameters
+MODELS = {"unimodal": (unimodal, unimodalJacobian, 3), "bimodal": (bimodal, bimodalJacobian, 6)}
+
+
+# Fits one model to many histograms at once with Levenberg-Marquardt, vectorized over the datasets.
+# x, y and mask have shape (datasets, bins): histograms with fewer bins are padded and their padding is masked out.
+# p0 has shape (datasets, parameters).
+# Returns pOpt, pcov (computed like curve_fit: inverse of J^T J at the optimum scaled by the residual variance) and a
+# boolean array telling which fits converged. Fits that didn't converge, stalled or have no finite covariance should be
+# redone with curve_fit. The widths are returned positive, see PositiveWidths.
+def batchFit(model, x, y, p0, mask, ftol=1.49012e-8, xtol=1.49012e-8, maxIterations=200):
+	function, jacobian, numberParameters = MODELS[model]
+	x, y, mask = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(mask, dtype=bool)
+	weights = mask.astype(float)
+
+	# Residuals and Jacobian of the datasets in rows. The parameters are passed as separate (datasets, 1) arrays, so
+	# they broadcast over the bins.
+	def evaluate(p, rows=slice(None)):
+		parameters = np.moveaxis(p[:, :, None], 1, 0)
+		with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+			residuals = weights[rows] * (function(x[rows], *parameters) - y[rows])
+			J = weights[rows][:, :, None] * jacobian(x[rows], *parameters)
+		return residuals, J
+
+	p = np.array(p0, dtype=float)
+	residuals, J = evaluate(p)
+	cost = np.sum(np.square(residuals), axis=1)
+	damping = np.full(len(p), 1e-3)
+	converged = np.zeros(len(p), dtype=bool)
+	stalled = np.zeros(len(p), dtype=bool)
+	identity = np.eye(numberParameters)
+
+	for iteration in range(maxIterations):
+		active = ~converged & ~stalled & np.isfinite(cost)
+		if not active.any():
+			break
+
+		# Marquardt step: (J^T J + damping * diag(J^T J)) step = -J^T r
+		Ja, ra = J[active], residuals[active]
+		JT = np.swapaxes(Ja, 1, 2)
+		A = JT @ Ja
+		g = (JT @ ra[:, :, None])[:, :, 0]
+		scale = np.diagonal(A, axis1=1, axis2=2)
+		scale = np.maximum(scale, 1e-12 * np.max(scale, axis=1, keepdims=True) + 1e-300)
+		with np.errstate(over='ignore', invalid='ignore'):
+			M = A + (damping[active, None] * scale)[:, :, None] * identity
+		try:
+			step = np.linalg.solve(M, -g[:, :, None])[:, :, 0]
+		except np.linalg.LinAlgError:
+			step = np.stack([np.linalg.lstsq(m, -gi, rcond=None)[0] for m, gi in zip(M, g)])
+
+		pTrial = p[active] + step
+		residualsTrial, JTrial = evaluate(pTrial, active)
+		costTrial = np.sum(np.square(residualsTrial), axis=1)
+
+		# Accept steps that lower the cost and relax the damping, otherwise increase the damping and try again
+		accept = np.isfinite(costTrial) & (costTrial < cost[active])
+		reduction = cost[active] - costTrial
+		index = np.flatnonzero(active)
+		accepted = index[accept]
+		small = (accept & ((reduction <= ftol * cost[active]) |
+			(np.linalg.norm(step, axis=1) <= xtol * (np.linalg.norm(pTrial, axis=1) + xtol))))
+
+		p[accepted] = pTrial[accept]
+		residuals[accepted] = residualsTrial[accept]
+		J[accepted] = JTrial[accept]
+		cost[accepted] = costTrial[accept]
+		damping[index] = np.where(accept, np.maximum(damping[index] / 10, 1e-12), damping[index] * 10)
+
+		# Converged when the last step barely changed the cost or the parameters. A fit where no step lowers the cost
+		# any more (damping grew huge) without having converged is stuck, e.g. on a peak running off to infinity.
+		converged[index[small]] = True
+		stalled[index[~accept & (damping[index] > 1e16)]] = True
+
+	converged &= np.all(np.isfinite(p), axis=1)
+
+	# Flip the Jacobian columns of the widths with them
+	sign = np.where(np.arange(numberParameters) % 3 == 2, np.sign(p), 1)
+	sign[sign == 0] = 1
+	p = PositiveWidths(p)
+	J = J * sign[:, None, :]
+
+	# Covariance as curve_fit computes it: pinv(J^T J) * sum(r^2) / (bins - parameters)
+	numberBins = mask.sum(axis=1)
+	A = np.swapaxes(J, 1, 2) @ J
+	pcov = np.full((len(p), numberParameters, numberParameters), np.inf)
+	invertible = converged & (np.linalg.matrix_rank(np.where(np.isfinite(A), A, 0)) == numberParameters)
+	if invertible.any():
+		with np.errstate(divide='ignore', invalid='ignore'):
+			variance = np.where(numberBins > numberParameters, cost / (numberBins - numberParameters), np.inf)
+		pcov[invertible] = np.linalg.inv(A[invertible]) * variance[invertible, None, None]
+	converged &= invertible & np.all(np.isfinite(pcov), axis=(1, 2))
+
+	return p, pcov, converged
+
+# The widths (every third parameter) only enter the models squared, so a fit can return them with either sign. Both
+# engines store them positive, so their results don't differ in sign.
+def PositiveWidths(p):
+	p = np.array(p, dtype=float)
+	p[..., 2::3] = np.abs(p[..., 2::3])
+	return p
\ No newline at end of file
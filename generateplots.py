@@ -4,59 +4,94 @@ from matplotlib.pyplot import savefig
 from matplotlib.pyplot import close as closeFigure
 from os.path import exists
 from os import makedirs
+from timings import Timings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
 
-def generateplots(dataList, path):
+# Saves and closes the current figure. In svg and pdf files the DPI only sets the resolution of rasterized layers.
+def saveFigure(fileName, outputType, dpi):
+	savefig(fileName + "." + outputType, dpi=dpi)
+	closeFigure("all")
 
+# Renders and saves the histogram or ECDF of a single dataset. Used by the serial loop and by the worker processes.
+def saveDatasetFigure(plotType, d, path):
+	if plotType == "Histogram":
+		fig = plots.HistogramPlot(d)
+		fileName = path + "/" + d.path[1] + "/" + d.path[2]
+	elif plotType == "ECDF":
+		fig = plots.ECDF(d)
+		fileName = path + "/" + d.path[1] + "/" + d.path[2] + "-ECDF"
+	saveFigure(fileName, c.PlotConfig.get(plotType + ".OutputType"), c.PlotConfig.get(plotType + ".DPI"))
+
+# Worker processes get both configs explicitly and render off-screen with the Agg backend
+def initWorker(config, plotConfig):
+	import matplotlib
+	matplotlib.use("Agg")
+	c.Config(config)
+	c.PlotConfig(plotConfig)
 	plots.setFont()
 
-	if c.PlotConfig.get("Histogram2D.Generate") == True:
-		Histogram2D = plots.Histogram2D(dataList)
-		fig = plots.Histogram2DPlot(Histogram2D)
-		outputType = c.PlotConfig.get("Histogram2D.OutputType")
-		if outputType == "svg" or outputType == "pdf":
-			savefig(path + "/histogram2D." + outputType)
-		else:
-			savefig(path + "/histogram2D." + outputType, dpi=dpi)
-		closeFigure("all")
-
-	if c.PlotConfig.get("Violinplot.Generate") == True:
-		fig = plots.ViolinPlot(dataList)
-		outputType = c.PlotConfig.get("Violinplot.OutputType")
-		if outputType == "svg" or outputType == "pdf":
-			savefig(path + "/violinplot." + outputType)
-		else:
-			savefig(path + "/violinplot." + outputType, dpi=dpi)
-		closeFigure("all")
-
-	if c.PlotConfig.get("Simpleplot.Generate") == True:
-		fig = plots.SimplePlot(dataList)
-		outputType = c.PlotConfig.get("Simpleplot.OutputType")
-		if outputType == "svg" or outputType == "pdf":
-			savefig(path + "/simpleplot." + outputType)
-		else:
-			savefig(path + "/simpleplot." + outputType, dpi=dpi)
-		closeFigure("all")
-
-	if c.PlotConfig.get("Histogram.Generate"):
-		for d in dataList:
-			fig = plots.HistogramPlot(d)
-			outputType = c.PlotConfig.get("Histogram.OutputType")
-			if not exists(path + "/" + d.path[1]):
-				makedirs(path + "/" + d.path[1])
-			if outputType == "svg" or outputType == "pdf":
-				savefig(path + "/" + d.path[1] + "/" + d.path[2] + "." + outputType)
-			else:
-				savefig(path + "/" + d.path[1] + "/" + d.path[2] + "." + outputType, dpi=dpi)
-			closeFigure("all")
-
-	if c.PlotConfig.get("ECDF.Generate"):
-		for d in dataList:
-			fig = plots.ECDF(d)
-			outputType = c.PlotConfig.get("ECDF.OutputType")
-			if not exists(path + "/" + d.path[1]):
-				makedirs(path + "/" + d.path[1])
-			if outputType == "svg" or outputType == "pdf":
-				savefig(path + "/" + d.path[1] + "/" + d.path[2] + "-ECDF" + "." + outputType)
-			else:
-				savefig(path + "/" + d.path[1] + "/" + d.path[2] + "-ECDF" + "." + outputType, dpi=dpi)
-			closeFigure("all")
\ No newline at end of file
+# Saves all figures that are enabled in the plot config. Returns the time (and peak memory) per figure type when
+# General.Timings is enabled, otherwise an empty dictionary.
+def generateplots(dataList, path, progress=None):
+	timings = Timings(c.PlotConfig.get("General.Timings", False), c.PlotConfig.get("General.TimingsMemory", False))
+	try:
+		plots.setFont()
+
+		# Per-dataset figures. These are the bulk of the work, so they can be rendered in parallel.
+		datasetFigures = []
+		for plotType in ["Histogram", "ECDF"]:
+			if c.PlotConfig.get(plotType + ".Generate"):
+				for d in dataList:
+					if not exists(path + "/" + d.path[1]):
+						makedirs(path + "/" + d.path[1])
+					datasetFigures.append((plotType, d))
+
+		numberFigures = len(datasetFigures) + sum(c.PlotConfig.get(plotType + ".Generate") == True for plotType in ["Histogram2D", "Violinplot", "Simpleplot"])
+		figuresDone = 0
+
+		def figureDone():
+			nonlocal figuresDone
+			figuresDone = figuresDone + 1
+			if progress != None:
+				progress.emit(int(100 * figuresDone / numberFigures))
+
+		if c.PlotConfig.get("Histogram2D.Generate") == True:
+			with timings.stage("Histogram2D"):
+				Histogram2D = plots.Histogram2D(dataList)
+				fig = plots.Histogram2DPlot(Histogram2D)
+				saveFigure(path + "/histogram2D", c.PlotConfig.get("Histogram2D.OutputType"), c.PlotConfig.get("Histogram2D.DPI"))
+			figureDone()
+
+		if c.PlotConfig.get("Violinplot.Generate") == True:
+			with timings.stage("Violinplot"):
+				fig = plots.ViolinPlot(dataList)
+				saveFigure(path + "/violinplot", c.PlotConfig.get("Violinplot.OutputType"), c.PlotConfig.get("Violinplot.DPI"))
+			figureDone()
+
+		if c.PlotConfig.get("Simpleplot.Generate") == True:
+			with timings.stage("Simpleplot"):
+				fig = plots.SimplePlot(dataList)
+				saveFigure(path + "/simpleplot", c.PlotConfig.get("Simpleplot.OutputType"), c.PlotConfig.get("Simpleplot.DPI"))
+			figureDone()
+
+		# General.Workers sets the number of processes. 1 (default) renders the figures one by one, 0 uses all cores.
+		workers = c.PlotConfig.get("General.Workers", 1)
+		# The time of every histogram and ECDF adds up to one stage per figure type. In parallel only the time of the whole
+		# pool is known.
+		if workers == 1:
+			for plotType, d in datasetFigures:
+				with timings.stage(plotType):
+					saveDatasetFigure(plotType, d, path)
+				figureDone()
+		elif len(datasetFigures) > 0:
+			with timings.stage("DatasetFigures"):
+				with ProcessPoolExecutor(max_workers = workers or None, mp_context = get_context("spawn"), initializer = initWorker, initargs = (c.Config.config, c.PlotConfig.config)) as executor:
+					futures = [executor.submit(saveDatasetFigure, plotType, d, path) for plotType, d in datasetFigures]
+					for future in as_completed(futures):
+						future.result()
+						figureDone()
+
+		return timings.stages
+	finally:
+		timings.stop()
\ No newline at end of file
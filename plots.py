@@ -6,15 +6,14 @@ from os import getcwd, makedirs
 from os.path import exists
 import matplotlib.pyplot as plt
 from matplotlib import rc, rcParams
-from statsmodels.distributions.empirical_distribution import ECDF as smECDF
-from scipy.stats import norm
 from matplotlib.cbook import violin_stats
 
-# All plot are generated in ggplot's style
-plt.style.use('ggplot')
-
-# Sets font for the text in plots
+# Sets the ggplot style and the font for the text in plots. Called before plotting rather than on import, so importing
+# this module doesn't touch matplotlib's global state.
 def setFont():
+	# All plot are generated in ggplot's style
+	plt.style.use('ggplot')
+
 	if c.PlotConfig.get("General.LaTeX"):
 		rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
 		rc('text', usetex=True)
@@ -66,73 +65,49 @@ class Histogram2D():
 				_, yBinEdges = np.histogram(y, bins=numberBins)
 			return yBinEdges
 
-		#Make 1 dimensional arrays for both x and y.
-		x = []
-		for index in range(0, len(self.data)):
-			x.append(np.full(self.data[index].shape, self.concentration[index]))
-		xNotFlat = np.asarray(x, dtype = object)
-		x = np.concatenate(xNotFlat).ravel()
+		#Pool the data of all datasets to find the bin edges in the y direction.
 		y = np.concatenate(self.data).ravel()
 
 		#Load/calculate # bins in x and y direction. For x we minimise # bins while preventing bins from touching other bins directly on the horizontal axis. For y i recommend taking the square root of # data points in y dimension. Normally that would overestimate # bins but we are not plotting a normal histogram.
 		self.yBinEdges = bin(c.PlotConfig.get("Histogram2D.Bin"), y)
 
-		indexes = np.unique(self.concentration, return_index=True)[1]
-		concentrationUnique = [self.concentration[index] for index in sorted(indexes)]
-		xBinWidth = (x_binwidth(np.asarray(concentrationUnique))/2)
+		#Group the datasets by concentration. concentrationUnique is sorted, inverse gives the group of every dataset and numberDuplicates the size of every group.
+		concentrationUnique, inverse, numberDuplicates = np.unique(self.concentration, return_inverse=True, return_counts=True)
+		xBinWidth = np.ravel(x_binwidth(concentrationUnique))[0]/2
 
 		#Make lists of bin edges of the x axis
 		self.xBinEdges = []
-		for currentConc in sorted(concentrationUnique):
+		for currentConc in concentrationUnique:
 			self.xBinEdges.append(currentConc - xBinWidth*0.5)
 			self.xBinEdges.append(currentConc + xBinWidth*0.5)
-		
-		#Normalize each datagroup either by area or amplitude
-		numberDuplicates = []
-		individualHistograms = []
+
+		#Every concentration gets its own column (0, 2, 4, ...) in one 2D histogram. The columns in between are the empty gaps between concentrations.
+		xBinWidths = np.diff(self.xBinEdges)
+		yBinWidths = np.diff(self.yBinEdges)
+		histogram = np.zeros((len(self.yBinEdges) - 1, len(self.xBinEdges) - 1))
+
+		#Normalize each datagroup either by area or amplitude and add histograms of the same concentration to each other
 		for i in range(0, len(self.data)):
-			ind = np.where(self.concentration == xNotFlat[i][0])
-			numberDuplicates.append(len(ind[0]))
+			column = 2 * inverse[i]
+			hist = np.histogram(self.data[i], bins=self.yBinEdges)[0].astype(float)
 			if c.PlotConfig.get("Histogram2D.Normalisation") == "area":
-				hist, self.xBinEdges, self.yBinEdges = np.histogram2d(xNotFlat[i], self.data[i], bins=(self.xBinEdges,self.yBinEdges), density = True)
-				hist = hist / numberDuplicates[i]
+				#Same arithmetic as np.histogram2d with density = True, divided by # experiments at this concentration
+				hist = hist / xBinWidths[column] / yBinWidths / hist.sum() / numberDuplicates[inverse[i]]
 			elif c.PlotConfig.get("Histogram2D.Normalisation") == "amplitude":
-				hist, self.xBinEdges, self.yBinEdges = np.histogram2d(xNotFlat[i], self.data[i], bins=[self.xBinEdges,self.yBinEdges])
 				with np.errstate(divide='ignore',invalid='ignore'):
-					hist = hist / hist.max(axis=1, keepdims=True)
-			individualHistograms.append(hist.T)
-
-		#Make an index list of concentrations for each unique concentration
-		indexList = []
-		for currentConc in concentrationUnique:
-			ind = np.where(self.concentration == currentConc)
-			indexList.append(ind[0])
-
-		#Add histograms of the same concentration to each other
-		self.histogramList = []
-		for i in indexList:
-			if len(i) > 1:
-				currentHistogram = individualHistograms[i[0]]
-				for k in range(1, len(i)):
-					currentHistogram = currentHistogram + individualHistograms[i[k]]
-				currentHistogram[currentHistogram == 0] = np.nan
-				self.histogramList.append(currentHistogram)
-			else:
-				currentHistogram = individualHistograms[i[0]]
-				currentHistogram[currentHistogram == 0] = np.nan
-				self.histogramList.append(currentHistogram)
+					hist = hist / hist.max()
+			histogram[:, column] += hist
+		histogram[histogram == 0] = np.nan
 
 		#If we normalised by amplitude we need to again normalise since we did an addition. We don't need to normalize by area again because we divided the histogram by # experiments.
 		if c.PlotConfig.get("Histogram2D.Normalisation") == "amplitude":
-			for i in range(0, len(self.histogramList)):
-				with np.errstate(divide='ignore',invalid='ignore'):
-					self.histogramList[i] = self.histogramList[i] / np.nanmax(self.histogramList[i])
+			with np.errstate(divide='ignore',invalid='ignore'):
+				histogram[:, ::2] = histogram[:, ::2] / np.nanmax(histogram[:, ::2], axis=0)
+
+		self.histogramList = [histogram]
 
 		#Find our maximum color for the color scale
-		maxList = []
-		for i in self.histogramList:
-			maxList.append(np.nanmax(i))
-		self.maxDensity = max(maxList)
+		self.maxDensity = np.nanmax(histogram)
 
 def Histogram2DPlot(histogram2D):
 	# Plot parameters
@@ -301,6 +276,8 @@ def HistogramPlot(d):
 
 	ax2 = ax1.twinx()
 	ax2.plot(d.xKDE, d.yKDE, color=colorKDE, zorder = 1, label='KDE', linewidth = 2.8 * scaleLine)
+	if len(d.confb95) > 0:
+		ax2.fill_between(d.xKDE, d.confb95[0], d.confb95[1], color=colorKDE, alpha = 0.3, linewidth = 0, zorder = 0, label='KDE 90% CI')
 	ax2.plot(x, y, '--', color=colorFit, zorder = 2, label='Fit', linewidth = 2.8 * scaleLine)
 	ax2.set_ylabel("Density", fontsize=labelFontSize)
 	ax2.tick_params(axis='y', labelsize=tickFontSize)
@@ -310,7 +287,28 @@ def HistogramPlot(d):
 	fig.tight_layout()
 	return fig
 
+# Sorted values and cumulative probabilities of the ECDF of x, reduced to the points that start a new cell of a columns
+# by rows pixel grid. The ECDF is monotone in both directions, so it passes through at most columns + rows cells and the
+# dropped points lie within a pixel of a kept one. Also returns whether points were dropped.
+def ECDFEnvelope(x, columns, rows):
+	x = np.sort(x)
+	n = len(x)
+	y = np.arange(1, n + 1) / n
+	if n < 2:
+		return x, y, False
+
+	span = x[-1] - x[0] if x[-1] > x[0] else 1
+	column = np.minimum(((x - x[0]) / span * columns).astype(np.int64), columns - 1)
+	row = np.minimum((y * rows).astype(np.int64), rows - 1)
+	cell = column * rows + row
+	keep = np.concatenate([[0], np.flatnonzero(np.diff(cell)) + 1])
+	if keep[-1] != n - 1:
+		keep = np.append(keep, n - 1)
+	return x[keep], y[keep], len(keep) < n
+
 def ECDF(d):
+	# scipy.stats is slow to import and only needed here
+	from scipy.stats import norm
 
 	def mystep(x,y, ax=None, where='post', **kwargs):
 		assert where in ['post', 'pre']
@@ -337,16 +335,19 @@ def ECDF(d):
 
 	dataFiltered = d.filterData()
 
-	ecdf = smECDF(dataFiltered)
+	# Only draw as many points as the saved figure has pixels, and rasterize the empirical layers when that dropped
+	# points, so vector files don't grow with the size of the dataset
+	pixelsPerInch = max(dpi, plt.rcParams["figure.dpi"])
+	ecdfX, ecdfY, dense = ECDFEnvelope(dataFiltered, int(np.ceil(xDim * pixelsPerInch)), int(np.ceil(yDim * pixelsPerInch)))
 
 	theory_x = np.arange(d.minRMS, d.maxRMS, 0.5)
 	pdf = norm.pdf(theory_x, loc=d.pOpt[1], scale=d.pOpt[2])
 	cdf = np.cumsum(pdf * 0.5)
 
 	fig, ax = plt.subplots(figsize=(xDim, yDim))
-	mystep(ecdf.x, ecdf.y, lw = scaleScatter/20, color = colorScatter)
+	mystep(ecdfX, ecdfY, lw = scaleScatter/20, color = colorScatter, rasterized = dense)
 	plt.plot(theory_x, cdf, "--", color=colorFit, lw = scaleLine, alpha = alphaFit, label = "Theoretical CDF")
-	plt.scatter(ecdf.x, ecdf.y, marker='.', linewidths = 0, color=colorScatter, s = scaleScatter, label = "Empirical CDF")
+	plt.scatter(ecdfX, ecdfY, marker='.', linewidths = 0, color=colorScatter, s = scaleScatter, label = "Empirical CDF", rasterized = dense)
 	ax.set_xlabel("RMS (nm)", fontsize = labelFontSize)
 	ax.set_ylabel("Cumulative probability", fontsize = labelFontSize)
 	ax.tick_params(axis="x", labelsize=tickFontSize)
@@ -403,7 +404,7 @@ def ViolinPlot(dataList):
 	p = -1
 	for item in x_unique:
 		p = p + 1
-		ind = np.where(concentration == item)
+		ind = np.where(np.asarray(concentration) == item)
 		temp = yKDE[ind[0][0]]
 		if len(ind[0]) > 1:
 			for i in range(1,len(ind[0])):
@@ -0,0 +1,56 @@
+import os
+import json
+import zipfile
+import hashlib
+import numpy as np
+import config as c
+
+# Persistent cache of analysis results.
+# Every dataset gets an entry in the cache folder: one .npz file with the KDE, bin edges and fit of the dataset. The
+# name of the entry is a hash of the raw RMS values, the name of the dataset and the config settings the results depend
+# on, so a dataset is only analysed again when its data or one of those settings changed. Changing anything else, such
+# as the blacklist or the number of workers, keeps all entries valid.
+
+# Bump when a change to the analysis gives different results for the same data and config, so old entries are not used
+RESULTVERSION = 4
+
+# The Data fields stored in an entry
+FIELDS = ["xKDE", "yKDE", "confb95", "binEdges", "pOpt", "pVar", "mode"]
+
+
+# The config settings the results of a dataset depend on
+def configKey():
+	dataParam = {name: c.Config.get("DataParam." + name) for name in ["MinRMS", "MaxRMS", "KDE", "KDEBootstrap", "Bin"]}
+	return {"Version": RESULTVERSION, "DataParam": dataParam, "FittingParam": c.Config.get("FittingParam")}
+
+
+# Name of the entry of a dataset. The dataset name is part of it because DataParam.Bin and FittingParam.p0b can hold
+# settings for single datasets. configKey can be passed in when hashing many datasets.
+def datasetKey(rawData, path, config=None):
+	sha1 = hashlib.sha1()
+	sha1.update(json.dumps(config or configKey(), sort_keys = True, default = str).encode("utf-8"))
+	sha1.update((path[1] + "/" + path[2]).encode("utf-8"))
+	sha1.update(np.ascontiguousarray(rawData, dtype = np.float64).data)
+	return sha1.hexdigest()
+
+
+# Returns the cached fields of a dataset ({field: value}), or None if there is no entry for the key
+def load(cacheDir, key):
+	try:
+		with np.load(cacheDir + "/" + key + ".npz") as entry:
+			cached = {name: entry[name] for name in FIELDS}
+	except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+		return None
+	cached["mode"] = str(cached["mode"])
+	return cached
+
+
+def store(cacheDir, key, d):
+	if not os.path.exists(cacheDir):
+		os.makedirs(cacheDir)
+	entry = cacheDir + "/" + key + ".npz"
+
+	# Written under a temporary name first, so an interrupted write never leaves an entry that looks valid
+	with open(entry + ".tmp", "wb") as file:
+		np.savez(file, **{name: np.asarray(getattr(d, name)) for name in FIELDS})
+	os.replace(entry + ".tmp", entry)
\ No newline at end of file
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from adaptivekde import binnedkernel
+
+
+@pytest.mark.parametrize("bw_method", ["scott", "silverman", 0.05, 0.5])
+def test_matches_gaussian_kde(bw_method):
+    stats = pytest.importorskip("scipy.stats")
+    rng = np.random.default_rng(0)
+    x = np.concatenate([rng.normal(100, 7, 2000), rng.normal(145, 8, 1000)])
+    tin = np.linspace(50, 170, 1000)
+
+    y, t, w = binnedkernel(x, tin, bw_method)
+    reference = stats.gaussian_kde(x, bw_method)(tin)
+    np.testing.assert_array_equal(t, tin)
+    assert np.max(np.abs(y - reference)) < 2e-4 * np.max(reference)
+
+
+@pytest.mark.parametrize("x", [np.full(10, 120.0), np.array([120.0])])
+def test_no_spread_gives_spike(x):
+    tin = np.linspace(50, 170, 1000)
+
+    y, t, w = binnedkernel(x, tin)
+    assert w == 0
+    assert np.count_nonzero(y) == 1
+    assert abs(t[np.argmax(y)] - 120) <= (t[1] - t[0]) / 2
+    np.testing.assert_allclose(np.sum(y) * (t[1] - t[0]), 1)
+
+
+def test_no_spread_outside_grid():
+    y, t, w = binnedkernel(np.full(5, 200.0), np.linspace(50, 170, 100))
+    assert not y.any()
+
+
+def test_empty():
+    with pytest.raises(ValueError):
+        binnedkernel(np.array([]), np.linspace(50, 170, 100))
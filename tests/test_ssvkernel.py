@@ -0,0 +1,139 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from adaptivekde import jit
+
+# adaptivekde/__init__.py rebinds the name ssvkernel to the function
+ssv = importlib.import_module("adaptivekde.ssvkernel")
+
+WINDOWS = ["Boxcar", "Laplace", "Cauchy", "Gauss"]
+
+
+# Reference implementations: the per-bin and per-window loops that
+# CostFunction and the local cost matrix of ssvkernel used before they were
+# vectorized and batched.
+def loopCostFunction(y_hist, N, t, dt, optws, WIN, WinFunc, g):
+    L = y_hist.size
+    optwv = np.zeros((L, ))
+    for k in range(L):
+        gs = optws[:, k] / WIN
+        if g > np.max(gs):
+            optwv[k] = np.min(WIN)
+        else:
+            if g < min(gs):
+                optwv[k] = np.max(WIN)
+            else:
+                idx = np.max(np.nonzero(gs >= g))
+                optwv[k] = g * WIN[idx]
+
+    optwp = np.zeros((L, ))
+    for k in range(L):
+        if WinFunc == 'Boxcar':
+            Z = ssv.Boxcar(t[k]-t, optwv / g)
+        elif WinFunc == 'Laplace':
+            Z = ssv.Laplace(t[k]-t, optwv / g)
+        elif WinFunc == 'Cauchy':
+            Z = ssv.Cauchy(t[k]-t, optwv / g)
+        else:
+            Z = ssv.Gauss(t[k]-t, optwv / g)
+        optwp[k] = np.sum(optwv * Z) / np.sum(Z)
+
+    idx = y_hist.nonzero()
+    y_hist_nz = y_hist[idx]
+    t_nz = t[idx]
+    yv = np.zeros((L, ))
+    for k in range(L):
+        yv[k] = np.sum(y_hist_nz * dt * ssv.Gauss(t[k]-t_nz, optwp[k]))
+    yv = yv * N / np.sum(yv * dt)
+
+    cg = yv**2 - 2 * yv * y_hist + 2 / (2 * np.pi)**0.5 / optwp * y_hist
+    Cg = np.sum(cg * dt)
+
+    return Cg, yv, optwp
+
+
+def loopOptws(y_hist, dt, W, WinFunc):
+    M = W.size
+    L = y_hist.size
+    c = np.zeros((M, L))
+    for j in range(M):
+        w = W[j]
+        yh = ssv.fftkernel(y_hist, w / dt)
+        c[j, :] = yh**2 - 2 * yh * y_hist + 2 / (2 * np.pi)**0.5 / w * y_hist
+
+    optws = np.zeros((M, L))
+    for i in range(M):
+        Win = W[i]
+        C_local = np.zeros((M, L))
+        for j in range(M):
+            C_local[j, :] = ssv.fftkernelWin(c[j, :], Win / dt, WinFunc)
+        n = np.argmin(C_local, axis=0)
+        optws[i, :] = W[n]
+
+    return optws
+
+
+# Runs ssvkernel on a bimodal sample with gaps in it and returns the
+# arguments of its first CostFunction call: the histogram, grid, window sizes
+# and the optws matrix built by the batched FFTs.
+def costFunctionInputs(WinFunc):
+    rng = np.random.default_rng(0)
+    x = np.concatenate([rng.normal(100, 6, 300), rng.normal(145, 4, 200)])
+    tin = np.linspace(60, 170, 300)
+
+    calls = []
+    CostFunction = ssv.CostFunction
+
+    def recordCostFunction(*args):
+        calls.append(args)
+        return CostFunction(*args)
+
+    ssv.CostFunction = recordCostFunction
+    try:
+        ssv.ssvkernel(x, tin, M=20, nbs=1, WinFunc=WinFunc)
+    finally:
+        ssv.CostFunction = CostFunction
+    return calls[0]
+
+
+@pytest.fixture(params=["numpy", "numba"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        monkeypatch.setattr(jit, "kernels", lambda: None)
+    elif jit.kernels() is None:
+        pytest.skip("Numba is not installed")
+    return request.param
+
+
+@pytest.mark.parametrize("WinFunc", WINDOWS)
+def test_optws_matches_loop(WinFunc):
+    y_hist, N, t, dt, optws, W = costFunctionInputs(WinFunc)[:6]
+    reference = loopOptws(y_hist, dt, W, WinFunc)
+
+    if WinFunc == "Gauss":
+        # At empty histogram bins all local costs are FFT round-off, so the
+        # argmin there depends on the order of the sums. Only compare the
+        # occupied bins.
+        occupied = y_hist > 0
+        assert not occupied.all()
+        np.testing.assert_array_equal(optws[:, occupied],
+                                      reference[:, occupied])
+    else:
+        np.testing.assert_array_equal(optws, reference)
+
+
+@pytest.mark.parametrize("WinFunc", WINDOWS)
+@pytest.mark.parametrize("chunk", [None, 7])
+def test_cost_function_matches_loop(backend, WinFunc, chunk):
+    y_hist, N, t, dt, optws, W = costFunctionInputs(WinFunc)[:6]
+
+    for g in [1e-3, 0.05, 0.3, 0.9]:
+        Cg, yv, optwp = ssv.CostFunction(y_hist, N, t, dt, optws, W, WinFunc,
+                                         g, chunk)
+        Cg0, yv0, optwp0 = loopCostFunction(y_hist, N, t, dt, optws, W,
+                                            WinFunc, g)
+        np.testing.assert_allclose(Cg, Cg0, rtol=1e-10)
+        np.testing.assert_allclose(yv, yv0, rtol=1e-10, atol=1e-14)
+        np.testing.assert_allclose(optwp, optwp0, rtol=1e-10)
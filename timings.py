@@ -0,0 +1,89 @@
+import time
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+# Shared no-op context manager returned by disabled timers
+NOTIMING = nullcontext()
+
+# Memory counters of the stages that are running, innermost last. tracemalloc has a single peak counter, so a stage
+# hands the peak it has seen so far to its parent before resetting the counter.
+OPENSTAGES = []
+
+# Per-stage wall time and, optionally, peak memory (tracemalloc) of the analysis and of generateplots.
+# Enabled by DataParam.Timings (analysis) or General.Timings (plots); DataParam.TimingsMemory and General.TimingsMemory
+# add the peak memory. tracemalloc slows down allocation heavy code, so it has its own switch.
+# When disabled, stage() returns the shared no-op context manager and nothing is measured.
+class Timings():
+
+	def __init__(self, enabled=False, memory=False):
+		self.enabled = bool(enabled)
+		self.memory = self.enabled and bool(memory)
+		self.stages = {}
+		# Only the Timings that started tracemalloc stops it, so nested runs (e.g. the datasets of an analysis) keep the
+		# tracing of the run they belong to
+		self.tracing = self.memory and not tracemalloc.is_tracing()
+		if self.tracing:
+			tracemalloc.start()
+
+	# Stops tracemalloc if this Timings started it. Call at the end of the run, or later runs in the same process stay
+	# traced even with the peak memory disabled.
+	def stop(self):
+		if self.tracing:
+			tracemalloc.stop()
+			self.tracing = False
+
+	# Use as "with timings.stage(name):". Stages can be nested. A stage that runs more than once (e.g. a figure type)
+	# adds up its time and keeps its highest peak.
+	def stage(self, name):
+		if not self.enabled:
+			return NOTIMING
+		return self.measure(name)
+
+	@contextmanager
+	def measure(self, name):
+		stage = self.stages.setdefault(name, {"Seconds": 0.0})
+		if self.memory:
+			if OPENSTAGES:
+				OPENSTAGES[-1]["Peak"] = max(OPENSTAGES[-1]["Peak"], tracemalloc.get_traced_memory()[1])
+			tracemalloc.reset_peak()
+			counter = {"Start": tracemalloc.get_traced_memory()[0], "Peak": 0}
+			OPENSTAGES.append(counter)
+		timeStart = time.perf_counter()
+		try:
+			yield
+		finally:
+			seconds = time.perf_counter() - timeStart
+			stage["Seconds"] = round(stage["Seconds"] + seconds, 4)
+			if self.memory:
+				OPENSTAGES.pop()
+				peak = max(counter["Peak"], tracemalloc.get_traced_memory()[1])
+				if OPENSTAGES:
+					OPENSTAGES[-1]["Peak"] = max(OPENSTAGES[-1]["Peak"], peak)
+				# Peak of the memory allocated during the stage, on top of what was allocated before it, in MB
+				stage["PeakMemoryMB"] = max(stage.get("PeakMemoryMB", 0.0), round((peak - counter["Start"]) / 2**20, 2))
+
+
+# Builds the Timings section of the export from the stages of the whole run and the stages of every dataset
+# ({"dir/file": stages}). DatasetTotals adds up the time of every dataset stage and keeps the highest peak memory.
+def TimingsSection(stages, datasetStages):
+	totals = {}
+	for datasetStage in datasetStages.values():
+		for name, stage in datasetStage.items():
+			total = totals.setdefault(name, {"Seconds": 0.0})
+			total["Seconds"] = round(total["Seconds"] + stage["Seconds"], 4)
+			if "PeakMemoryMB" in stage:
+				total["PeakMemoryMB"] = max(total.get("PeakMemoryMB", 0.0), stage["PeakMemoryMB"])
+
+	return {"Stages": stages, "DatasetTotals": totals, "Datasets": datasetStages}
+
+
+# Formats stages as one "name: seconds (peak memory)" line per stage, for the GUI and the command line
+def FormatStages(stages):
+	lines = []
+	for name, stage in stages.items():
+		line = name + ": " + format(stage["Seconds"], ".3f") + " s"
+		if "PeakMemoryMB" in stage:
+			line = line + " (peak " + format(stage["PeakMemoryMB"], ".1f") + " MB)"
+		lines.append(line)
+	return "\n".join(lines)
\ No newline at end of file